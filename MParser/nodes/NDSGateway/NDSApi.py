@@ -1,24 +1,73 @@
 from fastapi import APIRouter, HTTPException, Body, Response, WebSocket, WebSocketDisconnect
-from typing import Dict, List, Any, Optional
-from NDSPool import NDSPool, PoolConfig
+from fastapi.responses import StreamingResponse
+from typing import Dict, List, Any, Optional, AsyncIterator, Tuple, Deque
+from contextlib import AsyncExitStack, asynccontextmanager
+from NDSPool import NDSPool, PoolConfig, LANE_SCAN, LANE_READ
+from NDSCoalescer import NDSCoalescer, ReadRequest, ReadGroup, SingleFlight, merge_ranges
+from NDSCache import ZipInfoCache, ScanSnapshotStore, BlockCache
+from NDSClient import NDSClient, ScanTimeFilter, NDSFileNotFoundError, NDSBusyError, NDSIOError
+from NDSLimiter import ByteBudget
+from NDSCodec import TransferCodec
+from NDSTuner import PoolTuner
+from NDSPrefetch import BundlePrefetcher
 from HttpClient import HttpClient
 from pydantic import BaseModel
+from collections import OrderedDict, deque
 import logging
+import struct
+import time
+import json
 
 logger = logging.getLogger(__name__)
 
+# 批量读取的帧格式: 帧头(序号 uint32, 状态码 int32, 数据长度 uint64, 小端) + 数据;
+# 状态码为0时数据为区间内容, 否则为UTF-8编码的错误信息(404文件不存在, 500读取失败)
+BATCH_FRAME_STRUCT = "<IiQ"
+BATCH_FRAME_SIZE = struct.calcsize(BATCH_FRAME_STRUCT)
+
 router = APIRouter(prefix="/nds", tags=["NDS"])
 
 
 class NDSApi:
     def __init__(self):
         self.pool = NDSPool()
+        self.coalescer = NDSCoalescer(self.pool)
+        self.flights = SingleFlight()  # 相同的ZIP目录解析与区间读取共享一次执行
+        self.read_budget = ByteBudget()
+        self.tuner = PoolTuner(self.pool)
+        self.zip_cache = ZipInfoCache()
+        self.block_cache = BlockCache()
+        self.file_versions: OrderedDict[Tuple[str, str], Tuple[float, Dict[str, Any]]] = OrderedDict()
+        self.version_ttl = NDSClient.STAT_CACHE_TTL  # 文件大小与修改时间的缓存时间(秒), 与连接上的stat缓存一致
+        self.version_limit = 4096
+        self.scan_snapshots = ScanSnapshotStore()
+        self.scan_stats: Dict[str, Dict[str, Any]] = {}  # "nds_id:scan_path" -> 最近一次扫描统计
+        self.scan_concurrency = 8  # 扫描时同时列举的目录数
+        self.scan_ftp_connections = 4  # FTP扫描最多使用的连接数
+        self.stream_chunk_size = 512 * 1024  # 流式读取时单块的字节数
+        self.coalesce_limit = 1024 * 1024  # 不超过该长度的读取经合并器整块读取
+        self.batch_limit = 256  # 单次批量读取的最大区间数
+        self.cache_read_blocks = 4  # 启用块缓存时流式读取每次从NDS读取的最大块数
+        self.prefetcher = BundlePrefetcher(self.pool, self.block_cache, self.read_budget, self.file_version,
+                                           self.cache_read_blocks)
+        self.pool_defaults: Dict[str, Any] = {}  # 网关级的连接池配置, 对所有服务器生效
         self.backend_client = None
 
-    async def init_api(self, backend_url: str):
+    async def init_api(self, backend_url: str, zip_cache_dir: Optional[str] = None,
+                       zip_cache_size: Optional[int] = None, zip_cache_disk_size: Optional[int] = None,
+                       read_budget_size: Optional[int] = None,
+                       read_queue_timeout: Optional[float] = None, block_cache_size: Optional[int] = None,
+                       block_cache_dir: Optional[str] = None, block_cache_disk_size: Optional[int] = None,
+                       pool_defaults: Optional[Dict[str, Any]] = None):
         """初始化API"""
         self.backend_client = HttpClient(backend_url)
+        self.pool_defaults.update(pool_defaults or {})
+        self.zip_cache.configure(max_bytes=zip_cache_size, disk_dir=zip_cache_dir, disk_max_bytes=zip_cache_disk_size)
+        self.block_cache.configure(max_bytes=block_cache_size, disk_dir=block_cache_dir,
+                                   disk_max_bytes=block_cache_disk_size)
+        self.read_budget.configure(max_bytes=read_budget_size, max_wait=read_queue_timeout)
         await self.init_pool()
+        self.tuner.start()  # 之后经update-pool添加的服务器同样参与调整
 
     async def init_pool(self):
         """初始化连接池"""
@@ -29,20 +78,345 @@ class NDSApi:
 
             for nds in data.get('list', []):
                 if nds['Switch'] == 1:
-                    pool_config = PoolConfig(
-                        protocol=nds['Protocol'],
-                        host=nds['Address'],
-                        port=nds['Port'],
-                        user=nds['Account'],
-                        passwd=nds['Password']
-                    )
-                    self.pool.add_server(str(nds['ID']), pool_config)
+                    self.pool.add_server(str(nds['ID']), PoolConfig.from_record(nds, self.pool_defaults))
             print("Add NDSPool Count:", len(data.get('list', [])))
         except Exception as e:
             logger.error(f"Failed to initialize pool: {e}")
 
+    async def get_zip_info(self, client, server_id: str, file_path: str) -> List[Dict[str, Any]]:
+        """获取ZIP子文件信息, 同一文件的并发请求共享一次解析"""
+        return await self.flights.do(("zip-info", server_id, file_path),
+                                     lambda: self._get_zip_info(client, server_id, file_path))
+
+    async def _get_zip_info(self, client, server_id: str, file_path: str) -> List[Dict[str, Any]]:
+        """获取ZIP子文件信息, 以文件路径、大小和修改时间为键缓存解析结果"""
+        stat_info = await client.stat(file_path)
+        if not stat_info:
+            raise FileNotFoundError(f"File not found: {file_path}")
+        key = self.zip_cache.make_key(server_id, stat_info)
+        infos = await self.zip_cache.get(key)
+        if infos is None:
+            infos = [
+                {
+                    "file_name": info.file_name,
+                    "sub_file_name": info.sub_file_name,
+                    "directory": info.directory,
+                    "header_offset": int(info.header_offset),
+                    "compress_size": int(info.compress_size),
+                    "file_size": int(info.file_size),
+                    "flag_bits": int(info.flag_bits),
+                    "compress_type": int(info.compress_type),
+                    "enodebid": int(info.enodebid)
+                }
+                for info in await client.get_zip_info(file_path)
+            ]
+            await self.zip_cache.put(key, infos)
+        return infos
+
+    @asynccontextmanager
+    async def scan_clients(self, server_id: str):
+        """获取扫描使用的连接, FTP额外借用当前空闲的连接用于并发列举
+
+        借用的连接数不超过扫描按权重应得的份额, 有读取请求排队时不再借用
+
+        Yields:
+            (主连接, 额外连接列表)
+        """
+        async with AsyncExitStack() as stack:
+            client = await stack.enter_async_context(self.pool.get_client(server_id, lane=LANE_SCAN))
+            peers = []
+            if client.protocol == "FTP":
+                limit = min(self.scan_ftp_connections, self.pool.lane_share(server_id, LANE_SCAN))
+                for _ in range(limit - 1):
+                    if self.pool.lane_waiting(server_id, LANE_READ):
+                        break
+                    peer = await stack.enter_async_context(self.pool.get_client(server_id, wait=False, lane=LANE_SCAN))
+                    if peer is None:
+                        break
+                    peers.append(peer)
+            yield client, peers
+
+    async def scan(self, server_id: str, scan_path: str, filter_pattern: Optional[str] = None,
+                   incremental: bool = True, since: Optional[str] = None,
+                   delta: bool = False, time_filter: Optional[ScanTimeFilter] = None) -> Any:
+        """扫描目录
+
+        Args:
+            incremental: 是否使用目录快照增量扫描
+            since: 上次扫描返回的令牌, delta为True时使用
+            delta: 为True时返回 {token, full, added, removed}: 令牌与快照一致时只包含差异,
+                   否则 full 为True, added 为完整文件列表. 不能与 time_filter 同时使用
+            time_filter: 时间窗口过滤, 剪枝窗口外的目录与文件
+        """
+        if delta and time_filter is not None:
+            raise ValueError("Scan delta cannot be combined with time windows")
+        snapshot = self.scan_snapshots.get(server_id, scan_path, filter_pattern) if incremental or delta else None
+        previous_token = snapshot.token if snapshot else None
+        async with self.scan_clients(server_id) as (client, peers):
+            try:
+                files = await client.scan(scan_path, filter_pattern, self.scan_concurrency, peers, snapshot,
+                                          time_filter)
+            finally:
+                self.scan_stats[f"{server_id}:{scan_path}"] = dict(client.scan_stats)
+            if not delta:
+                return files
+            if since and since == previous_token:
+                return {"token": snapshot.token, "full": False, **{
+                    key: client.scan_delta[key] for key in ("added", "removed")
+                }}
+            return {"token": snapshot.token, "full": True, "added": files, "removed": []}
+
+    async def iter_scan(self, server_id: str, scan_path: str, filter_pattern: Optional[str] = None,
+                        incremental: bool = True,
+                        time_filter: Optional[ScanTimeFilter] = None) -> AsyncIterator[Tuple[str, List[str]]]:
+        """流式扫描目录, 每列举完一个目录即返回其中匹配的文件"""
+        snapshot = self.scan_snapshots.get(server_id, scan_path, filter_pattern) if incremental else None
+        async with self.scan_clients(server_id) as (client, peers):
+            try:
+                async for item in client.iter_scan(scan_path, filter_pattern, self.scan_concurrency, peers, snapshot,
+                                                   time_filter):
+                    yield item
+            finally:
+                self.scan_stats[f"{server_id}:{scan_path}"] = dict(client.scan_stats)
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取网关状态: 连接池、缓存、读取合并与扫描统计"""
+        return {
+            "pools": self.pool.get_all_pool_status(),
+            "zip_cache": self.zip_cache.get_status(),
+            "block_cache": self.block_cache.get_status(),
+            "prefetch": self.prefetcher.get_status(),
+            "stat_cache": NDSClient.get_stat_status(),
+            "handle_cache": NDSClient.get_handle_status(),
+            "coalescer": self.coalescer.get_status(),
+            "single_flight": self.flights.get_status(),
+            "read_budget": self.read_budget.get_status(),
+            "pool_tuner": self.tuner.get_status(),
+            "codecs": TransferCodec.get_status(),
+            "scans": self.scan_stats,
+            "scan_snapshots": self.scan_snapshots.get_status()
+        }
+
+    def read_charge(self, size: Optional[int]) -> int:
+        """估算一次流式读取在网关内同时缓冲的字节数: 合并读取为整个区间, 否则为单个数据块"""
+        if size and size <= self.coalesce_limit:
+            return size
+        return self.stream_chunk_size
+
+    async def read_range(self, server_id: str, file_path: str, offset: int = 0, size: Optional[int] = None) -> bytes:
+        """读取文件区间, 相同区间的并发请求共享一次读取"""
+        return await self.flights.do(("read", server_id, file_path, offset, size),
+                                     lambda: self._read_range(server_id, file_path, offset, size))
+
+    def block_charge(self, offset: int, size: Optional[int]) -> int:
+        """经块缓存读取时实际从NDS读入的字节数: 区间覆盖的整块数据"""
+        block_size = self.block_cache.block_size
+        end = offset + (size or self.coalesce_limit)
+        return ((end - 1) // block_size - offset // block_size + 1) * block_size
+
+    async def _read_range(self, server_id: str, file_path: str, offset: int, size: Optional[int]) -> bytes:
+        """读取文件区间, 指定长度的请求经合并器与同文件的并发请求合并传输"""
+        if self.block_cache.enabled:
+            async with self.read_budget.acquire(self.block_charge(offset, size)):
+                return await self.read_blocks(server_id, file_path, offset, size)
+        async with self.read_budget.acquire(size or self.coalesce_limit):
+            if size:
+                return await self.coalescer.read(server_id, file_path, offset, size)
+            return await self.pool.run(server_id, lambda client: client.read_range(file_path, offset), shared=True)
+
+    async def file_version(self, server_id: str, file_path: str) -> Dict[str, Any]:
+        """获取文件大小与修改时间, 结果缓存version_ttl秒
+
+        Raises:
+            NDSFileNotFoundError: 文件不存在
+        """
+        key = (server_id, file_path)
+        item = self.file_versions.get(key)
+        if item is not None and time.monotonic() - item[0] <= self.version_ttl:
+            return item[1]
+        stat_info = await self.flights.do(
+            ("stat", server_id, file_path),
+            lambda: self.pool.run(server_id, lambda client: client.stat(file_path), shared=True))
+        if not stat_info:
+            self.file_versions.pop(key, None)
+            raise NDSFileNotFoundError(f"File not found: {file_path}", "NDSApi.file_version")
+        self.file_versions[key] = (time.monotonic(), dict(stat_info))
+        self.file_versions.move_to_end(key)
+        while len(self.file_versions) > self.version_limit:
+            self.file_versions.popitem(last=False)
+        return stat_info
+
+    async def read_blocks(self, server_id: str, file_path: str, offset: int, size: Optional[int]) -> bytes:
+        """经块缓存读取文件区间: 命中的数据块直接使用, 连续缺失的数据块合并为一次读取后写入缓存"""
+        stat_info = await self.file_version(server_id, file_path)
+        file_size = stat_info['size']
+        end = file_size if size is None else min(offset + size, file_size)
+        if end <= offset:
+            return b""
+        block_size = self.block_cache.block_size
+        first, last = offset // block_size, (end - 1) // block_size
+        blocks: Dict[int, bytes] = {}
+        missing: List[int] = []
+        for block in range(first, last + 1):
+            data = await self.block_cache.get(
+                self.block_cache.make_key(server_id, file_path, stat_info['modify'], block))
+            if data is None:
+                missing.append(block)
+            else:
+                blocks[block] = data
+        runs: List[List[int]] = []
+        for block in missing:
+            if runs and runs[-1][-1] == block - 1:
+                runs[-1].append(block)
+            else:
+                runs.append([block])
+        for run in runs:
+            begin = run[0] * block_size
+            data = await self.coalescer.read(server_id, file_path, begin, min(
+                (run[-1] + 1) * block_size, file_size) - begin)
+            for block in run:
+                piece = data[(block - run[0]) * block_size:(block - run[0] + 1) * block_size]
+                blocks[block] = piece
+                if len(piece) == min(block_size, file_size - block * block_size):  # 文件被截断时不缓存
+                    await self.block_cache.put(
+                        self.block_cache.make_key(server_id, file_path, stat_info['modify'], block), piece)
+        # 只截取区间内的部分拼接, 整块读入的数据不再整体复制
+        parts = []
+        for block in range(first, last + 1):
+            base = block * block_size
+            parts.append(memoryview(blocks[block])[max(offset - base, 0):end - base])
+        return parts[0].tobytes() if len(parts) == 1 else b"".join(parts)
+
+    async def iter_range(self, server_id: str, file_path: str, offset: int = 0,
+                         size: Optional[int] = None) -> AsyncIterator[bytes]:
+        """流式读取文件区间, 数据块到达即返回, 下一块在调用方取走上一块后才读取
+
+        不超过coalesce_limit的读取经read_range整块读取, 以便与相同或同文件的并发请求合并;
+        启用块缓存时按块对齐的窗口经缓存读取;
+        读取前申请网关字节预算, 预算不足且排队超时时抛出NDSBusyError
+        """
+        if size and size <= self.coalesce_limit:
+            yield await self.read_range(server_id, file_path, offset, size)
+            return
+        if self.block_cache.enabled:
+            # 启用块缓存时按块对齐的窗口经缓存读取
+            window = self.block_cache.block_size * self.cache_read_blocks
+            async with self.read_budget.acquire(window + self.block_cache.block_size):
+                file_size = (await self.file_version(server_id, file_path))['size']
+                end = file_size if size is None else min(offset + size, file_size)
+                pos = offset
+                while pos < end:
+                    stop = min((pos // window + 1) * window, end)
+                    yield await self.read_blocks(server_id, file_path, pos, stop - pos)
+                    pos = stop
+            return
+        async with self.read_budget.acquire(self.read_charge(size)):
+            for attempt in range(self.pool.IO_RETRY_COUNT + 1):
+                started = False
+                try:
+                    async with self.pool.get_shared_client(server_id) as client:
+                        async for chunk in client.iter_range(file_path, offset, size, self.stream_chunk_size):
+                            started = True
+                            yield chunk
+                    return
+                except NDSIOError as e:
+                    # 尚未发出数据时连接失效可换用新连接重试, 已发出部分数据则无法透明恢复
+                    if started or attempt >= self.pool.IO_RETRY_COUNT:
+                        raise
+                    logger.warning(f"NDS[{server_id}] Stream read error, retry on a new connection: {e}")
+
+    async def iter_batch(self, server_id: str, ranges: List[Dict[str, Any]]) -> AsyncIterator[Tuple[int, int, bytes]]:
+        """批量读取同一NDS上的多个区间
+
+        在一条连接上按 (文件路径, 偏移) 顺序读取, 同一文件相邻或重叠的区间合并为一次传输;
+        单个区间失败不影响其他区间, 连接失效时换用新连接继续读取剩余区间
+
+        Args:
+            server_id: NDS服务器ID
+            ranges: 区间列表, 每项包含FilePath、HeaderOffset、CompressSize(为None表示读取到文件末尾, 为0时返回空数据)
+        Yields:
+            (请求序号, 状态码, 数据), 按读取顺序返回; 状态码非0时数据为错误信息
+        """
+        files: Dict[str, List[ReadRequest]] = {}
+        empty: List[int] = []  # 长度为0的区间, 不访问NDS
+        for index, item in enumerate(ranges):
+            if item.get('CompressSize') == 0:
+                empty.append(index)
+                continue
+            # ReadRequest.size为0表示读取到文件末尾
+            files.setdefault(item['FilePath'], []).append(
+                ReadRequest(offset=item.get('HeaderOffset') or 0, size=item.get('CompressSize') or 0, index=index))
+        # 同一时刻只缓冲一个合并区间
+        charge = min(sum(item.get('CompressSize') or self.stream_chunk_size
+                         for item in ranges if item.get('CompressSize') != 0), self.coalescer.max_span)
+
+        pending = deque(sorted(files))  # 尚未开始读取的文件
+        groups: Deque[Tuple[str, ReadGroup]] = deque()  # 当前文件尚未读取的合并区间
+        attempt = 0
+        async with self.read_budget.acquire(charge):
+            for index in empty:
+                yield index, 0, b""
+            while pending or groups:
+                try:
+                    async with self.pool.get_shared_client(server_id) as client:
+                        while pending or groups:
+                            if not groups:
+                                file_path = pending[0]
+                                requests = files[file_path]
+                                if any(not req.size for req in requests):
+                                    info = await client.stat(file_path)
+                                    if not info:
+                                        pending.popleft()
+                                        for req in requests:
+                                            yield req.index, 404, f"文件不存在: {file_path}".encode('utf-8')
+                                        continue
+                                    for req in requests:
+                                        req.size = req.size or max(info['size'] - req.offset, 0)
+                                pending.popleft()
+                                groups.extend((file_path, group) for group in
+                                              merge_ranges(requests, self.coalescer.max_gap, self.coalescer.max_span))
+                                continue
+                            file_path, group = groups[0]
+                            try:
+                                data = await client.read_range(file_path, group.start, group.size)
+                            except NDSFileNotFoundError:
+                                groups.popleft()
+                                for req in group.requests:
+                                    yield req.index, 404, f"文件不存在: {file_path}".encode('utf-8')
+                                continue
+                            except NDSIOError:
+                                raise  # 连接可能已失效, 交由连接池关闭后换用新连接读取剩余区间
+                            except Exception as e:
+                                groups.popleft()
+                                logger.error(f"NDS[{server_id}] Batch read error {file_path}: {e}")
+                                for req in group.requests:
+                                    yield req.index, 500, str(e).encode('utf-8')
+                                continue
+                            groups.popleft()
+                            view = memoryview(data)
+                            for req in group.requests:
+                                begin = req.offset - group.start
+                                yield req.index, 0, bytes(view[begin:begin + req.size])
+                            view.release()
+                except NDSIOError as e:
+                    if attempt < self.pool.IO_RETRY_COUNT:
+                        attempt += 1
+                        logger.warning(f"NDS[{server_id}] Batch read error, retry on a new connection: {e}")
+                        continue
+                    logger.error(f"NDS[{server_id}] Batch read error: {e}")
+                    message = str(e).encode('utf-8')
+                    for _, group in groups:
+                        for req in group.requests:
+                            yield req.index, 500, message
+                    for file_path in pending:
+                        for req in files[file_path]:
+                            yield req.index, 500, message
+                    return
+
     async def close(self):
         """关闭资源"""
+        await self.tuner.stop()
+        await self.prefetcher.stop()
         await self.pool.close()
         if self.backend_client:
             await self.backend_client.close()
@@ -61,6 +435,49 @@ class ReadFileRequest(BaseModel):
     CompressSize: Optional[int] = None
 
 
+class ReadRange(BaseModel):
+    """批量读取中的单个区间"""
+    FilePath: str
+    HeaderOffset: Optional[int] = 0
+    CompressSize: Optional[int] = None
+    CompressType: Optional[int] = 0  # 子文件在包内的压缩方式, 非0时不再进行传输压缩
+
+
+class ReadBatchRequest(BaseModel):
+    """批量读取请求模型"""
+    NDSID: int
+    Ranges: List[ReadRange]
+    Codecs: Optional[List[str]] = None  # 可接受的传输编码, 按优先顺序
+
+
+def busy_error(error: NDSBusyError) -> HTTPException:
+    """网关繁忙(429/503)或NDS熔断(502)时返回状态码及Retry-After"""
+    return HTTPException(
+        status_code=error.status_code,
+        detail=error.message,
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
+
+def busy_message(error: NDSBusyError) -> Dict[str, Any]:
+    """网关繁忙时通过WebSocket或NDJSON返回的消息"""
+    return {"code": error.status_code, "message": error.message, "retry_after": error.retry_after}
+
+
+def pack_frame_header(index: int, status: int, length: int) -> bytes:
+    """生成批量读取的帧头"""
+    return struct.pack(BATCH_FRAME_STRUCT, index, status, length)
+
+
+async def encode_frame(codec: TransferCodec, ranges: List[Any], index: int, status: int, data: bytes) -> bytes:
+    """生成批量读取的完整帧, 成功且未压缩的子文件数据按协商的编码压缩"""
+    item = ranges[index]
+    compress_type = item.get('CompressType') if isinstance(item, dict) else item.CompressType
+    if status == 0 and not compress_type:
+        data = await codec.encode(data)
+    return pack_frame_header(index, status, len(data)) + data
+
+
 @router.post("/update-pool")
 async def update_pool(data: Dict[str, Any] = Body(...)) -> Dict[str, str]:
     """更新连接池配置"""
@@ -82,6 +499,7 @@ async def update_pool(data: Dict[str, Any] = Body(...)) -> Dict[str, str]:
             if 'ID' not in config:
                 raise HTTPException(status_code=400, detail="Missing ID in config")
             await nds_api.pool.remove_server(str(config['ID']))
+            nds_api.scan_snapshots.drop(str(config['ID']))
             return {"message": "Server removed"}
 
         # 处理添加和更新操作
@@ -96,23 +514,18 @@ async def update_pool(data: Dict[str, Any] = Body(...)) -> Dict[str, str]:
         # 如果Switch为0，执行删除操作
         if config['Switch'] != 1:
             await nds_api.pool.remove_server(str(config['ID']))
+            nds_api.scan_snapshots.drop(str(config['ID']))
             return {"message": "Server removed due to Switch off"}
 
         # 创建连接池配置
-        pool_config = PoolConfig(
-            protocol=config['Protocol'],
-            host=config['Address'],
-            port=config['Port'],
-            user=config['Account'],
-            passwd=config['Password']
-        )
+        pool_config = PoolConfig.from_record(config, nds_api.pool_defaults)
 
         # 执行相应操作
         if action == "add":
             nds_api.pool.add_server(str(config['ID']), pool_config)
-        else:  # update
-            await nds_api.pool.remove_server(str(config['ID']))
-            nds_api.pool.add_server(str(config['ID']), pool_config)
+        else:  # update, 连接相关配置未变化时保留现有连接
+            if await nds_api.pool.update_server(str(config['ID']), pool_config):
+                nds_api.scan_snapshots.drop(str(config['ID']))
 
         return {"message": f"Server {action}ed successfully"}
 
@@ -122,7 +535,7 @@ async def update_pool(data: Dict[str, Any] = Body(...)) -> Dict[str, str]:
 
 
 @router.post("/scan")
-async def scan_files(data: dict = Body(...)) -> List[str]:
+async def scan_files(data: dict = Body(...)) -> Any:
     """扫描文件"""
     try:
         nds_id = data.get('nds_id')
@@ -131,19 +544,73 @@ async def scan_files(data: dict = Body(...)) -> List[str]:
 
         if not nds_id or not scan_path:
             raise HTTPException(status_code=400, detail="Missing required parameters")
-
-        async with nds_api.pool.get_client(str(nds_id)) as client:
-            return await client.scan(scan_path, filter_pattern)
+        try:
+            time_filter = ScanTimeFilter.from_request(data.get('time_windows'), data.get('time_pattern'))
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Invalid time windows: {e}")
+        if time_filter is not None and 'since' in data:
+            raise HTTPException(status_code=400, detail="since cannot be combined with time_windows")
+
+        # 携带 since 字段时返回自该令牌以来的差异
+        return await nds_api.scan(
+            str(nds_id),
+            scan_path,
+            filter_pattern,
+            incremental=data.get('incremental', True),
+            since=data.get('since'),
+            delta='since' in data,
+            time_filter=time_filter
+        )
+    except HTTPException:
+        raise
+    except NDSBusyError as e:
+        raise busy_error(e)
     except Exception as e:
         logger.error(f"NDS[{data.get('nds_id')}]Scan files error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/scan-stream")
+async def scan_files_stream(data: dict = Body(...)) -> StreamingResponse:
+    """流式扫描文件
+
+    以NDJSON逐行返回: 每个目录一行 {"directory": str, "files": [str]},
+    完成后返回 {"end_of_scan": true, "stats": {...}}, 出错时返回 {"code": 500, "message": str}
+    """
+    nds_id = data.get('nds_id')
+    scan_path = data.get('scan_path')
+    filter_pattern = data.get('filter_pattern')
+
+    if not nds_id or not scan_path:
+        raise HTTPException(status_code=400, detail="Missing required parameters")
+    if str(nds_id) not in nds_api.pool.get_server_ids():
+        raise HTTPException(status_code=403, detail=f"NDS服务器 {nds_id} 未配置")
+    try:
+        time_filter = ScanTimeFilter.from_request(data.get('time_windows'), data.get('time_pattern'))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid time windows: {e}")
+
+    async def generate():
+        try:
+            async for directory, files in nds_api.iter_scan(
+                    str(nds_id), scan_path, filter_pattern, data.get('incremental', True), time_filter):
+                yield json.dumps({"directory": directory, "files": files}, ensure_ascii=False) + "\n"
+            stats = nds_api.scan_stats.get(f"{nds_id}:{scan_path}", {})
+            yield json.dumps({"end_of_scan": True, "stats": stats}, ensure_ascii=False) + "\n"
+        except NDSBusyError as e:
+            yield json.dumps(busy_message(e), ensure_ascii=False) + "\n"
+        except Exception as e:
+            logger.error(f"NDS[{nds_id}]Scan files error: {str(e)}")
+            yield json.dumps({"code": 500, "message": str(e)}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
 @router.get("/status")
 async def get_pool_status() -> Dict:
-    """获取连接池状态"""
+    """获取网关状态"""
     try:
-        return nds_api.pool.get_all_pool_status()
+        return nds_api.get_status()
     except Exception as e:
         logger.error(f"Get pool status error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -159,27 +626,13 @@ async def get_zip_info(data: dict = Body(...)):
         if not nds_id or not file_paths:
             raise HTTPException(status_code=400, detail="Missing required parameters")
         
-        async with nds_api.pool.get_client(str(nds_id)) as client:
+        async with nds_api.pool.get_client(str(nds_id), lane=LANE_SCAN) as client:
             zip_infos = {}
             for file_path in file_paths:
                 try:
-                    result = await client.get_zip_info(file_path)
                     zip_infos[file_path] = {
                         "status": "success",
-                        "info": [
-                            {
-                                "file_name": info.file_name,
-                                "sub_file_name": info.sub_file_name,
-                                "directory": info.directory,
-                                "header_offset": int(info.header_offset),
-                                "compress_size": int(info.compress_size),
-                                "file_size": int(info.file_size),
-                                "flag_bits": int(info.flag_bits),
-                                "compress_type": int(info.compress_type),
-                                "enodebid": int(info.enodebid)
-                            }
-                            for info in result
-                        ]
+                        "info": await nds_api.get_zip_info(client, str(nds_id), file_path)
                     }
                 except Exception as e:
                     zip_infos[file_path] = {
@@ -193,11 +646,28 @@ async def get_zip_info(data: dict = Body(...)):
                 "data": zip_infos
             }
 
+    except HTTPException:
+        raise
+    except NDSBusyError as e:
+        raise busy_error(e)
     except Exception as e:
         logger.error(f"Get ZIP info error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/prefetch")
+async def prefetch_files(data: dict = Body(...)):
+    """提交新登记的文件包, 在连接池空闲时整包预读到块缓存"""
+    nds_id = data.get('nds_id')
+    file_paths = data.get('file_paths', [])
+    if not nds_id or not isinstance(file_paths, list):
+        raise HTTPException(status_code=400, detail="Missing required parameters")
+    return {
+        "code": 200,
+        "data": {"queued": nds_api.prefetcher.submit(str(nds_id), file_paths)}
+    }
+
+
 @router.post("/read")
 async def read_file(request: ReadFileRequest) -> Response:
     """读取NDS文件内容
@@ -210,11 +680,8 @@ async def read_file(request: ReadFileRequest) -> Response:
             - CompressSize: 要读取的字节数（可选，默认读取到文件末尾）
             
     Returns:
-        Response: 二进制响应，包含文件内容
-        响应头包含：
-        - Content-Type: application/octet-stream
-        - Content-Length: 文件大小
-        - X-File-Size: 文件大小
+        StreamingResponse: 分块传输的二进制响应(application/octet-stream), 数据从NDS读到即转发.
+        首块数据读取成功后才返回响应头, 之前的错误以404/500返回; 传输中途出错时连接被中断
     """
     try:
         # 检查NDS服务器是否已配置
@@ -224,27 +691,33 @@ async def read_file(request: ReadFileRequest) -> Response:
                 detail=f"NDS服务器 {request.NDSID} 未配置"
             )
 
-        # 获取NDS客户端连接
-        async with nds_api.pool.get_client(str(request.NDSID)) as client:
-            # 读取文件内容
-            content = await client.read_file_bytes(
-                file_path=request.FilePath,
-                header_offset=request.HeaderOffset or 0,
-                size=request.CompressSize
-            )
-            
-            # 直接返回二进制内容
-            return Response(
-                content=content,
-                media_type="application/octet-stream",
-                headers={
-                    "Content-Length": str(len(content)),
-                    "X-File-Size": str(len(content))
-                }
-            )
-            
-    except FileNotFoundError:
-        
+        chunks = nds_api.iter_range(
+            str(request.NDSID),
+            request.FilePath,
+            request.HeaderOffset or 0,
+            request.CompressSize
+        )
+        try:
+            first = await chunks.__anext__()
+        except StopAsyncIteration:
+            first = b""
+
+        async def content():
+            try:
+                if first:
+                    yield first
+                async for chunk in chunks:
+                    yield chunk
+            finally:
+                await chunks.aclose()
+
+        return StreamingResponse(content(), media_type="application/octet-stream")
+
+    except HTTPException:
+        raise
+    except NDSBusyError as e:
+        raise busy_error(e)
+    except (FileNotFoundError, NDSFileNotFoundError):
         raise HTTPException(
             status_code=404,
             detail=f"文件不存在: {request.FilePath}"
@@ -258,6 +731,46 @@ async def read_file(request: ReadFileRequest) -> Response:
         )
 
 
+@router.post("/read-batch")
+async def read_batch(request: ReadBatchRequest) -> Response:
+    """批量读取同一NDS上的多个区间
+
+    Returns:
+        StreamingResponse: 帧序列(格式见BATCH_FRAME_STRUCT), 每个区间一帧, 按网关规划的读取顺序返回,
+        通过帧头中的序号对应请求中的区间; 响应头X-Batch-Count为帧数, X-Codec为协商的传输编码.
+        启用传输编码时, 仅CompressType为0且状态码为0的帧数据经过编码, 帧头长度为编码后的长度
+    """
+    if str(request.NDSID) not in nds_api.pool.get_server_ids():
+        raise HTTPException(status_code=403, detail=f"NDS服务器 {request.NDSID} 未配置")
+    if len(request.Ranges) > nds_api.batch_limit:
+        raise HTTPException(status_code=400, detail=f"单次最多读取 {nds_api.batch_limit} 个区间")
+
+    frames = nds_api.iter_batch(str(request.NDSID), [item.model_dump() for item in request.Ranges])
+    try:
+        first = await frames.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except NDSBusyError as e:
+        raise busy_error(e)
+
+    codec = TransferCodec.negotiate(request.Codecs)
+
+    async def generate():
+        try:
+            if first is not None:
+                yield await encode_frame(codec, request.Ranges, *first)
+            async for index, status, data in frames:
+                yield await encode_frame(codec, request.Ranges, index, status, data)
+        finally:
+            await frames.aclose()
+
+    return StreamingResponse(
+        generate(),
+        media_type="application/octet-stream",
+        headers={"X-Batch-Count": str(len(request.Ranges)), "X-Codec": codec.name}
+    )
+
+
 # 添加 WebSocket 管理器
 class ConnectionManager:
     def __init__(self):
@@ -279,8 +792,12 @@ manager = ConnectionManager()
 
 @router.websocket("/ws/read/{client_id}")
 async def websocket_read(websocket: WebSocket, client_id: str):
-    """WebSocket读取文件接口"""
-    CHUNK_SIZE = 512 * 1024  # 512KB chunks
+    """WebSocket读取文件接口
+
+    数据块从NDS读到即发送, 发送完成(客户端接收)后才读取下一块.
+    请求中携带Codecs(可接受的传输编码列表)时, 先返回 {"codec": 选定的编码},
+    之后每条二进制消息为一个独立编码的数据块; CompressType非0的子文件不再压缩
+    """
     await manager.connect(websocket, client_id)
     try:
         # 等待接收读取文件的请求
@@ -295,28 +812,29 @@ async def websocket_read(websocket: WebSocket, client_id: str):
 
         # 获取NDS客户端连接并读取文件
         try:
-            content = None
-            async with nds_api.pool.get_client(str(data['NDSID'])) as client:
-                content = await client.read_file_bytes(
-                    file_path=data['FilePath'],
-                    header_offset=data.get('HeaderOffset', 0),
-                    size=data.get('CompressSize')
-                )
-                if not await client.check_connect():
-                    print("No Connected")
-            
-            if content is None:
-                raise Exception("Data is null")
-            
-            # 使用分块传输发送数据
-            for i in range(0, len(content), CHUNK_SIZE):
-                chunk = content[i:i + CHUNK_SIZE]
-                await websocket.send_bytes(chunk)
-            
+            chunks = nds_api.iter_range(
+                str(data['NDSID']),
+                data['FilePath'],
+                data.get('HeaderOffset') or 0,
+                data.get('CompressSize')
+            )
+            codec = TransferCodec.negotiate(data.get('Codecs'), data.get('CompressType'))
+            if data.get('Codecs') is not None:
+                await websocket.send_json({"codec": codec.name})
+            try:
+                async for chunk in chunks:
+                    await websocket.send_bytes(await codec.encode(chunk))
+            finally:
+                await chunks.aclose()
+
             # 发送结束标记
             await websocket.send_json({"end_of_file": True})
-                
-        except FileNotFoundError:
+
+        except WebSocketDisconnect:
+            raise
+        except NDSBusyError as e:
+            await websocket.send_json(busy_message(e))
+        except (FileNotFoundError, NDSFileNotFoundError):
             await websocket.send_json({
                 "code": 404,
                 "message": f"文件不存在: {data['FilePath']}"
@@ -345,3 +863,45 @@ async def websocket_read(websocket: WebSocket, client_id: str):
         except Exception:
             pass
 
+
+@router.websocket("/ws/read-batch/{client_id}")
+async def websocket_read_batch(websocket: WebSocket, client_id: str):
+    """WebSocket批量读取接口
+
+    请求格式同/read-batch, 携带Codecs时先返回 {"codec": 选定的编码};
+    每个区间以一条二进制消息(帧头+数据)返回, 全部发送后发送 {"end_of_batch": true}
+    """
+    await manager.connect(websocket, client_id)
+    try:
+        data = await websocket.receive_json()
+        if str(data['NDSID']) not in nds_api.pool.get_server_ids():
+            await websocket.send_json({"code": 403, "message": f"NDS服务器 {data['NDSID']} 未配置"})
+            return
+        ranges = data.get('Ranges') or []
+        if len(ranges) > nds_api.batch_limit:
+            await websocket.send_json({"code": 400, "message": f"单次最多读取 {nds_api.batch_limit} 个区间"})
+            return
+
+        codec = TransferCodec.negotiate(data.get('Codecs'))
+        if data.get('Codecs') is not None:
+            await websocket.send_json({"codec": codec.name})
+        try:
+            async for index, status, content in nds_api.iter_batch(str(data['NDSID']), ranges):
+                await websocket.send_bytes(await encode_frame(codec, ranges, index, status, content))
+            await websocket.send_json({"end_of_batch": True})
+        except WebSocketDisconnect:
+            raise
+        except NDSBusyError as e:
+            await websocket.send_json(busy_message(e))
+        except Exception as e:
+            await websocket.send_json({"code": 500, "message": str(e)})
+
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        try:
+            await websocket.send_json({"code": 500, "message": f"处理请求时发生错误: {str(e)}"})
+        except Exception:
+            pass
+    finally:
+        manager.disconnect(client_id)
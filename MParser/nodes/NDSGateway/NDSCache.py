@@ -0,0 +1,489 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple, Any, Set
+
+logger = logging.getLogger(__name__)
+
+ZipInfoKey = Tuple[str, str, int, Optional[str]]  # (nds_id, path, size, modify)
+BlockKey = Tuple[str, str, Optional[str], int]  # (nds_id, path, modify, block)
+
+
+class ZipInfoCache:
+    """ZIP中央目录解析结果缓存
+
+    以 (nds_id, path, size, modify) 为键的LRU缓存, 文件大小或修改时间变化即视为新文件.
+    内存占用按条目估算并受 max_bytes 限制, 可选写入本地目录作为二级存储;
+    磁盘文件按字节数上限 disk_max_bytes 做LRU淘汰, 重启后按文件修改时间恢复索引继续使用
+    """
+
+    ENTRY_OVERHEAD = 256  # 单条子文件信息的估算开销(字节)
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, disk_dir: Optional[str] = None,
+                 disk_max_bytes: int = 1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._items: OrderedDict[ZipInfoKey, Tuple[List[Dict[str, Any]], int]] = OrderedDict()
+        self._bytes = 0
+        self._disk_items: OrderedDict[str, int] = OrderedDict()  # 磁盘文件路径 -> 字节数
+        self._disk_bytes = 0
+        self._writing: Dict[str, int] = {}  # 正在写入的磁盘文件 -> 字节数, 写入完成后才加入索引
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def configure(self, max_bytes: Optional[int] = None, disk_dir: Optional[str] = None,
+                  disk_max_bytes: Optional[int] = None) -> None:
+        """更新缓存配置, 启用磁盘目录时由已有文件重建索引并按上限清理"""
+        if max_bytes:
+            self.max_bytes = max_bytes
+            self._evict()
+        if disk_max_bytes is not None:
+            self.disk_max_bytes = disk_max_bytes
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_items = self._scan_disk(disk_dir)
+            self._disk_bytes = sum(self._disk_items.values())
+            self.disk_dir = disk_dir
+        if self._use_disk():
+            self._remove(self._trim_disk())
+
+    def _use_disk(self) -> bool:
+        return bool(self.disk_dir) and self.disk_max_bytes > 0
+
+    @staticmethod
+    def _scan_disk(disk_dir: str) -> "OrderedDict[str, int]":
+        """按修改时间从旧到新列出磁盘目录中的缓存文件, 清理未写完的临时文件"""
+        found = []
+        for name in os.listdir(disk_dir):
+            path = os.path.join(disk_dir, name)
+            try:
+                if name.endswith(".json.tmp"):
+                    os.remove(path)
+                elif name.endswith(".json"):
+                    info = os.stat(path)
+                    found.append((info.st_mtime, path, info.st_size))
+            except OSError as e:
+                logger.warning(f"Scan zip info cache {path} error: {e}")
+        return OrderedDict((path, size) for _, path, size in sorted(found))
+
+    @staticmethod
+    def make_key(nds_id: str, stat_info: Dict[str, Any]) -> ZipInfoKey:
+        """由NDSClient.stat结果生成缓存键"""
+        return str(nds_id), stat_info['file_path'], int(stat_info['size']), stat_info.get('modify')
+
+    def _estimate(self, infos: List[Dict[str, Any]]) -> int:
+        return sum(self.ENTRY_OVERHEAD + len(info.get('sub_file_name') or '') for info in infos)
+
+    def _disk_path(self, key: ZipInfoKey) -> str:
+        digest = hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.disk_dir, f"{digest}.json")
+
+    def _remember(self, key: ZipInfoKey, infos: List[Dict[str, Any]]) -> None:
+        if key in self._items:
+            self._bytes -= self._items.pop(key)[1]
+        size = self._estimate(infos)
+        if size > self.max_bytes:
+            return
+        self._items[key] = (infos, size)
+        self._bytes += size
+        self._evict()
+
+    def _evict(self) -> None:
+        while self._bytes > self.max_bytes and self._items:
+            _, (_, size) = self._items.popitem(last=False)
+            self._bytes -= size
+
+    async def get(self, key: ZipInfoKey) -> Optional[List[Dict[str, Any]]]:
+        """查询缓存, 内存未命中时尝试从磁盘加载"""
+        item = self._items.get(key)
+        if item is not None:
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+        path = self._disk_path(key) if self._use_disk() else None
+        if path in self._disk_items:
+            self._disk_items.move_to_end(path)
+            infos = await asyncio.to_thread(self._load, path)
+            if infos is not None:
+                self._remember(key, infos)
+                self.disk_hits += 1
+                return infos
+            self._disk_bytes -= self._disk_items.pop(path, 0)
+        self.misses += 1
+        return None
+
+    async def put(self, key: ZipInfoKey, infos: List[Dict[str, Any]]) -> None:
+        """写入缓存"""
+        infos = [dict(info) for info in infos]
+        self._remember(key, infos)
+        if not self._use_disk():
+            return
+        path = self._disk_path(key)
+        if path in self._disk_items or path in self._writing:
+            return
+        data = await asyncio.to_thread(self._encode, infos)
+        if len(data) > self.disk_max_bytes:
+            return
+        self._writing[path] = len(data)
+        try:
+            await self._evict_disk()
+            stored = await asyncio.to_thread(self._dump, path, data)
+        finally:
+            del self._writing[path]
+        if stored:
+            self._disk_items[path] = len(data)
+            self._disk_bytes += len(data)
+            await self._evict_disk()
+
+    def _trim_disk(self) -> List[str]:
+        """按LRU移出磁盘索引, 使已写入与正在写入的字节数不超过上限, 返回待删除的文件"""
+        removed = []
+        while self._disk_bytes + sum(self._writing.values()) > self.disk_max_bytes and self._disk_items:
+            path, size = self._disk_items.popitem(last=False)
+            self._disk_bytes -= size
+            removed.append(path)
+        return removed
+
+    async def _evict_disk(self) -> None:
+        removed = self._trim_disk()
+        if removed:
+            await asyncio.to_thread(self._remove, removed)
+
+    @staticmethod
+    def _load(path: str) -> Optional[List[Dict[str, Any]]]:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Load zip info cache {path} error: {e}")
+            return None
+
+    @staticmethod
+    def _encode(infos: List[Dict[str, Any]]) -> bytes:
+        return json.dumps(infos, ensure_ascii=False).encode('utf-8')
+
+    @staticmethod
+    def _dump(path: str, data: bytes) -> bool:
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            return True
+        except Exception as e:
+            logger.warning(f"Dump zip info cache {path} error: {e}")
+            return False
+
+    @staticmethod
+    def _remove(paths: List[str]) -> None:
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning(f"Remove zip info cache {path} error: {e}")
+
+    def clear(self) -> None:
+        """清空内存缓存"""
+        self._items.clear()
+        self._bytes = 0
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取缓存统计"""
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._items),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "disk_dir": self.disk_dir,
+            "disk_entries": len(self._disk_items),
+            "disk_bytes": self._disk_bytes,
+            "disk_max_bytes": self.disk_max_bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0
+        }
+
+
+class BlockCache:
+    """文件数据块缓存(内存 + 可选本地磁盘)
+
+    文件按 block_size 切分为数据块, 以 (nds_id, path, modify, block) 为键缓存,
+    文件修改时间变化即视为新文件. 内存与磁盘分别按字节数上限做LRU淘汰,
+    写入时同时写入两级, 磁盘命中的数据块重新载入内存
+    """
+
+    def __init__(self, max_bytes: int = 0, block_size: int = 256 * 1024,
+                 disk_dir: Optional[str] = None, disk_max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._items: OrderedDict[BlockKey, bytes] = OrderedDict()
+        self._bytes = 0
+        self._disk_items: OrderedDict[BlockKey, int] = OrderedDict()  # 磁盘中的数据块 -> 字节数
+        self._disk_bytes = 0
+        self._writing: Dict[BlockKey, int] = {}  # 正在写入磁盘的数据块 -> 字节数, 写入完成后才加入索引
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bytes_saved = 0  # 命中缓存而未从NDS读取的字节数
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 or bool(self.disk_dir and self.disk_max_bytes > 0)
+
+    def configure(self, max_bytes: Optional[int] = None, disk_dir: Optional[str] = None,
+                  disk_max_bytes: Optional[int] = None) -> None:
+        """更新缓存配置, 磁盘目录中上次运行遗留的数据块无索引可用, 启用时清理"""
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+            self._evict()
+        if disk_max_bytes is not None:
+            self.disk_max_bytes = disk_max_bytes
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            for name in os.listdir(disk_dir):
+                if name.endswith(".blk"):
+                    try:
+                        os.remove(os.path.join(disk_dir, name))
+                    except OSError as e:
+                        logger.warning(f"Remove stale block {name} error: {e}")
+            self.disk_dir = disk_dir
+
+    def make_key(self, nds_id: str, file_path: str, modify: Optional[str], block: int) -> BlockKey:
+        return str(nds_id), file_path, modify, block
+
+    def _disk_path(self, key: BlockKey) -> str:
+        digest = hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.disk_dir, f"{digest}.blk")
+
+    def _remember(self, key: BlockKey, data: bytes) -> None:
+        if key in self._items:
+            self._bytes -= len(self._items.pop(key))
+        if len(data) > self.max_bytes:
+            return
+        self._items[key] = data
+        self._bytes += len(data)
+        self._evict()
+
+    def _evict(self) -> None:
+        while self._bytes > self.max_bytes and self._items:
+            _, data = self._items.popitem(last=False)
+            self._bytes -= len(data)
+
+    def _use_disk(self) -> bool:
+        return bool(self.disk_dir) and self.disk_max_bytes > 0
+
+    async def get(self, key: BlockKey) -> Optional[bytes]:
+        """查询数据块, 内存未命中时尝试从磁盘加载"""
+        data = self._items.get(key)
+        if data is not None:
+            self._items.move_to_end(key)
+            self.hits += 1
+            self.bytes_saved += len(data)
+            return data
+        if self._use_disk() and key in self._disk_items:
+            self._disk_items.move_to_end(key)
+            data = await asyncio.to_thread(self._load, self._disk_path(key))
+            if data is not None:
+                self._remember(key, data)
+                self.disk_hits += 1
+                self.bytes_saved += len(data)
+                return data
+            self._disk_bytes -= self._disk_items.pop(key, 0)
+        self.misses += 1
+        return None
+
+    def contains(self, key: BlockKey) -> bool:
+        """数据块是否已缓存(不计入命中统计)"""
+        return key in self._items or (self._use_disk() and key in self._disk_items)
+
+    async def put(self, key: BlockKey, data: bytes) -> None:
+        """写入数据块"""
+        data = bytes(data)
+        if self.max_bytes > 0:
+            self._remember(key, data)
+        if (not self._use_disk() or key in self._disk_items or key in self._writing
+                or len(data) > self.disk_max_bytes):
+            return
+        self._writing[key] = len(data)
+        try:
+            await self._evict_disk()
+            stored = await asyncio.to_thread(self._store, self._disk_path(key), data)
+        finally:
+            del self._writing[key]
+        if stored:
+            self._disk_items[key] = len(data)
+            self._disk_bytes += len(data)
+            await self._evict_disk()
+
+    async def _evict_disk(self) -> None:
+        """按LRU删除磁盘数据块, 使已写入与正在写入的字节数不超过上限"""
+        removed = []
+        while self._disk_bytes + sum(self._writing.values()) > self.disk_max_bytes and self._disk_items:
+            old_key, size = self._disk_items.popitem(last=False)
+            self._disk_bytes -= size
+            removed.append(self._disk_path(old_key))
+        if removed:
+            await asyncio.to_thread(self._remove, removed)
+
+    @staticmethod
+    def _load(path: str) -> Optional[bytes]:
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Load cached block {path} error: {e}")
+            return None
+
+    @staticmethod
+    def _remove(paths: List[str]) -> None:
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning(f"Remove cached block {path} error: {e}")
+
+    @staticmethod
+    def _store(path: str, data: bytes) -> bool:
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            return True
+        except Exception as e:
+            logger.warning(f"Store cached block {path} error: {e}")
+            return False
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取缓存统计"""
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "block_size": self.block_size,
+            "entries": len(self._items),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "disk_dir": self.disk_dir,
+            "disk_entries": len(self._disk_items),
+            "disk_bytes": self._disk_bytes,
+            "disk_max_bytes": self.disk_max_bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            "bytes_saved": self.bytes_saved
+        }
+
+
+@dataclass
+class DirSnapshot:
+    """单个目录的列举快照"""
+    mtime: Optional[float]
+    entries: List[Tuple[str, bool, Optional[float]]]  # (完整路径, 是否目录, 修改时间)
+    listed_at: float
+
+
+class ScanSnapshot:
+    """目录树扫描快照
+
+    记录各目录的修改时间与列举结果, 目录修改时间未变化时直接使用快照中的列举结果.
+    目录修改时间距列举时刻过近(guard秒内)的条目视为不稳定, 下次扫描仍重新列举,
+    以规避修改时间精度(通常为1秒)导致的漏检
+    """
+
+    def __init__(self, guard: float = 120):
+        self.guard = guard
+        self.dirs: Dict[str, DirSnapshot] = {}
+        self.token: Optional[str] = None
+        self.files: Set[str] = set()
+        self.hits = 0
+        self.lists = 0
+        self._visited: Set[str] = set()
+
+    def lookup(self, dir_path: str, mtime: Optional[float]) -> Optional[DirSnapshot]:
+        """查询目录快照, 修改时间一致且稳定时返回"""
+        self._visited.add(dir_path)
+        item = self.dirs.get(dir_path)
+        if item is None or mtime is None or item.mtime != mtime or item.listed_at - mtime <= self.guard:
+            return None
+        self.hits += 1
+        return item
+
+    def store(self, dir_path: str, mtime: Optional[float], entries: List[Tuple[str, bool, Optional[float]]]) -> None:
+        """记录目录列举结果"""
+        self._visited.add(dir_path)
+        self.lists += 1
+        self.dirs[dir_path] = DirSnapshot(mtime=mtime, entries=entries, listed_at=time.time())
+
+    def commit(self, files: List[str]) -> Dict[str, Any]:
+        """完成一次完整扫描: 清理已不存在的目录, 生成新的扫描令牌并返回与上次结果的差异"""
+        self.dirs = {path: item for path, item in self.dirs.items() if path in self._visited}
+        self._visited = set()
+        current = set(files)
+        delta = {
+            "since": self.token,
+            "added": sorted(current - self.files),
+            "removed": sorted(self.files - current)
+        }
+        self.files = current
+        self.token = uuid.uuid4().hex
+        delta["token"] = self.token
+        return delta
+
+    def abort(self) -> None:
+        """扫描中断, 丢弃本次的访问记录"""
+        self._visited = set()
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "directories": len(self.dirs),
+            "files": len(self.files),
+            "hits": self.hits,
+            "lists": self.lists,
+            "token": self.token
+        }
+
+
+class ScanSnapshotStore:
+    """按 (nds_id, 扫描根目录, 过滤规则) 管理扫描快照, 超出数量上限时淘汰最久未使用的快照"""
+
+    def __init__(self, max_snapshots: int = 64):
+        self.max_snapshots = max_snapshots
+        self._items: OrderedDict[Tuple[str, str, str], ScanSnapshot] = OrderedDict()
+
+    def get(self, nds_id: str, scan_path: str, filter_pattern: Optional[str]) -> ScanSnapshot:
+        key = (str(nds_id), scan_path, filter_pattern or "")
+        snapshot = self._items.get(key)
+        if snapshot is None:
+            snapshot = self._items[key] = ScanSnapshot()
+            while len(self._items) > self.max_snapshots:
+                self._items.popitem(last=False)
+        else:
+            self._items.move_to_end(key)
+        return snapshot
+
+    def drop(self, nds_id: str) -> None:
+        """删除指定NDS的全部快照"""
+        for key in [key for key in self._items if key[0] == str(nds_id)]:
+            del self._items[key]
+
+    def get_status(self) -> Dict[str, Any]:
+        return {":".join(key): snapshot.get_status() for key, snapshot in self._items.items()}
@@ -4,13 +4,17 @@ import stat
 import struct
 import aioftp
 import asyncio
+import time
+import calendar
 import inspect
 import logging
 import asyncssh
-from io import BytesIO
-from datetime import datetime
+from datetime import datetime, timedelta
+from collections import OrderedDict
+from dataclasses import dataclass
 from contextlib import asynccontextmanager
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, AsyncIterator, Tuple, Callable
+from NDSCache import ScanSnapshot
 
 # 配置日志
 logging.basicConfig(level=logging.ERROR)
@@ -18,11 +22,26 @@ logger = logging.getLogger(__name__)
 
 
 # ZIP 文件格式常量
-# ZIP_MAGIC = b"PK\003\004"
-# ZIP64_MAGIC = b"PK\x06\x06"
-# ZIP64_LOCATOR = b"PK\x06\x07"
-# ZIP_DIR_MAGIC = b"PK\001\002"
-# ZIP_END_MAGIC = b"PK\005\006"
+ZIP_MAGIC = b"PK\003\004"
+ZIP64_MAGIC = b"PK\x06\x06"
+ZIP64_LOCATOR = b"PK\x06\x07"
+ZIP_DIR_MAGIC = b"PK\001\002"
+ZIP_END_MAGIC = b"PK\005\006"
+ZIP_HEADER_STRUCT = "<4s2B4HL2L2H"  # 本地文件头
+ZIP_HEADER_SIZE = struct.calcsize(ZIP_HEADER_STRUCT)
+ZIP_DIR_STRUCT = "<4s4B4HL2L5H2L"  # 中央目录项
+ZIP_DIR_SIZE = struct.calcsize(ZIP_DIR_STRUCT)
+ZIP_END_STRUCT = "<4s4H2LH"  # 中央目录结束记录
+ZIP_END_SIZE = struct.calcsize(ZIP_END_STRUCT)
+ZIP64_END_STRUCT = "<4sQ2H2L4Q"  # ZIP64中央目录结束记录
+ZIP64_END_SIZE = struct.calcsize(ZIP64_END_STRUCT)
+ZIP64_LOCATOR_STRUCT = "<4sLQL"  # ZIP64中央目录结束定位器
+ZIP64_LOCATOR_SIZE = struct.calcsize(ZIP64_LOCATOR_STRUCT)
+ZIP_MAX_COMMENT = (1 << 16) - 1
+ZIP_MAX_EXTRACT_VERSION = 63  # 目前支持6.3及以下版本的ZIP包
+ZIP_FLAG_DATA_DESCRIPTOR = 0x08
+ZIP_FLAG_UTF8 = 0x800
+ZIP_DESCRIPTOR_SIZES = (12, 16, 20, 24)  # 数据描述符长度(有无签名, 是否ZIP64)
 
 
 class KeyType(dict):
@@ -48,6 +67,68 @@ def is_regex(pattern):
         return False
 
 
+class ScanTimeFilter:
+    """扫描时间窗口过滤
+
+    按路径中的时间戳(与扫描器相同的正则)过滤文件, 并按目录名中的日期/小时剪枝整个目录,
+    目录时间段前后各放宽一个单位
+    """
+
+    TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+    # 目录名数字位数 -> 时间格式
+    DIR_FORMATS = {6: '%Y%m', 8: '%Y%m%d', 10: '%Y%m%d%H', 12: '%Y%m%d%H%M'}
+
+    def __init__(self, windows: List[Tuple[datetime, datetime]], pattern: str = r'[_-](\d{14})'):
+        self.windows = windows
+        self.pattern = re.compile(pattern)
+
+    @classmethod
+    def from_request(cls, windows: Optional[List[List[str]]],
+                     pattern: Optional[str] = None) -> Optional["ScanTimeFilter"]:
+        """由请求参数 [[开始时间, 结束时间], ...] 构造过滤器, 未提供时间窗口时返回None"""
+        if not windows:
+            return None
+        if pattern and not is_regex(pattern):
+            raise NDSError("Time pattern error", level=1)
+        parsed = [(datetime.strptime(start, cls.TIME_FORMAT), datetime.strptime(end, cls.TIME_FORMAT))
+                  for start, end in windows]
+        return cls(parsed, pattern) if pattern else cls(parsed)
+
+    def accept_file(self, path: str) -> bool:
+        """文件时间是否落在任一时间窗口内, 无法提取时间的文件不接受"""
+        match = self.pattern.search(path)
+        if not match:
+            return False
+        try:
+            file_time = datetime.strptime(match.group(1) if match.groups() else match.group(0), '%Y%m%d%H%M%S')
+        except ValueError:
+            return False
+        return any(start <= file_time <= end for start, end in self.windows)
+
+    def accept_dir(self, path: str) -> bool:
+        """目录名表示的时间段是否可能与时间窗口相交, 目录名不是日期/小时时总是接受"""
+        name = path.rstrip('/').rsplit('/', 1)[-1]
+        digits = name.replace('-', '').replace('_', '')
+        time_format = self.DIR_FORMATS.get(len(digits))
+        if not time_format or not digits.isdigit():
+            return True
+        try:
+            start = datetime.strptime(digits, time_format)
+        except ValueError:
+            return True
+        if not 1990 <= start.year <= 2100:
+            return True
+        # 向前后各放宽一个目录单位: 跨越目录边界晚到的文件(如 2024010101/ 下的 _20240101005900)
+        # 时间仍在窗口内, 不能因目录被剪枝而漏扫, 否则扫描器会将其视为已删除
+        if len(digits) == 6:
+            end = start.replace(year=start.year + (start.month + 1) // 12, month=(start.month + 1) % 12 + 1)
+            start = start.replace(year=start.year - (start.month == 1), month=(start.month - 2) % 12 + 1)
+        else:
+            unit = {8: timedelta(days=1), 10: timedelta(hours=1), 12: timedelta(minutes=1)}[len(digits)]
+            start, end = start - unit, start + unit * 2
+        return any(start <= window_end and end > window_start for window_start, window_end in self.windows)
+
+
 class NDSError(Exception):
     """NDS客户端异常基类"""
 
@@ -83,6 +164,120 @@ class NDSIOError(NDSError):
     pass
 
 
+class NDSBusyError(NDSError):
+    """网关繁忙: 排队超过期限或等待者已满, 可在retry_after秒后重试"""
+
+    def __init__(self, message: str, from_module: Optional[str] = None,
+                 status_code: int = 503, retry_after: int = 1):
+        super().__init__(message, from_module or __name__, 1)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class NDSUnavailableError(NDSBusyError):
+    """NDS熔断中: 近期连接或读取持续失败, 请求被直接拒绝, 调用方应优先处理其他NDS的任务"""
+
+    def __init__(self, message: str, from_module: Optional[str] = None, retry_after: int = 30):
+        super().__init__(message, from_module, 502, retry_after)
+
+
+def parse_mtime(value) -> Optional[float]:
+    """将FTP(YYYYMMDDHHMMSS[.sss], UTC)或SFTP(时间戳)的修改时间统一为时间戳"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        text = str(value)
+        seconds = calendar.timegm(datetime.strptime(text[:14], '%Y%m%d%H%M%S').timetuple())
+        return seconds + (float(text[14:]) if text[14:].startswith('.') and len(text) > 15 else 0.0)
+    except ValueError:
+        return None
+
+
+def find_end_record(data) -> int:
+    """在尾部数据中从后向前查找中央目录结束记录, 兼容带注释的ZIP
+
+    Returns:
+        结束记录在data中的位置, 未找到返回-1
+    """
+    pos = data.rfind(ZIP_END_MAGIC)
+    while pos >= 0:
+        if pos + ZIP_END_SIZE <= len(data):
+            comment_length = struct.unpack_from("<H", data, pos + ZIP_END_SIZE - 2)[0]
+            if pos + ZIP_END_SIZE + comment_length <= len(data):
+                return pos
+        pos = data.rfind(ZIP_END_MAGIC, 0, pos)
+    return -1
+
+
+def parse_central_directory(data, start: int, size: int, concat: int = 0) -> List[Dict[str, Any]]:
+    """解析中央目录
+
+    Args:
+        data: 包含中央目录的数据
+        start: 中央目录在data中的起始位置
+        size: 中央目录字节数
+        concat: ZIP前附加数据长度, 用于修正本地文件头偏移
+    Returns:
+        条目列表, local_offset为本地文件头在文件中的实际位置
+    """
+    if start + size > len(data):
+        raise NDSZipError("Truncated central directory", "NDSClient.get_zip_info", 1)
+    entries = []
+    pos = start
+    end = start + size
+    while pos < end:
+        if pos + ZIP_DIR_SIZE > end:
+            raise NDSZipError("Truncated central directory", "NDSClient.get_zip_info", 1)
+        centdir = struct.unpack_from(ZIP_DIR_STRUCT, data, pos)
+        if centdir[0] != ZIP_DIR_MAGIC:
+            raise NDSZipError("Bad magic number for central directory", "NDSClient.get_zip_info", 1)
+        if centdir[3] > ZIP_MAX_EXTRACT_VERSION:
+            raise NDSZipError("zip file version %.1f" % (centdir[3] / 10), "NDSClient.get_zip_info", 1)
+        name_length, extra_length, comment_length = centdir[12], centdir[13], centdir[14]
+        pos += ZIP_DIR_SIZE
+        name = bytes(data[pos:pos + name_length])
+        flags = centdir[5]
+        compress_size, file_size, local_offset = centdir[10], centdir[11], centdir[18]
+        if 0xFFFFFFFF in (compress_size, file_size, local_offset):
+            # ZIP64扩展字段(0x0001), 仅包含结束记录中取值为0xFFFFFFFF的字段, 顺序固定
+            extra = data[pos + name_length:pos + name_length + extra_length]
+            offset = 0
+            while offset + 4 <= len(extra):
+                tag, length = struct.unpack_from("<2H", extra, offset)
+                if tag == 1:
+                    values = iter(struct.unpack_from(f"<{length // 8}Q", extra, offset + 4))
+                    if file_size == 0xFFFFFFFF:
+                        file_size = next(values)
+                    if compress_size == 0xFFFFFFFF:
+                        compress_size = next(values)
+                    if local_offset == 0xFFFFFFFF:
+                        local_offset = next(values)
+                    break
+                offset += 4 + length
+        entries.append({
+            "sub_file_name": name.decode('utf-8') if flags & ZIP_FLAG_UTF8 else name.decode('cp437'),
+            "name_length": name_length,
+            "local_offset": local_offset + concat,
+            "compress_size": compress_size,
+            "file_size": file_size,
+            "flag_bits": flags,
+            "compress_type": centdir[6]
+        })
+        pos += name_length + extra_length + comment_length
+    return entries
+
+
+@dataclass
+class OpenHandle:
+    """缓存的远程文件句柄"""
+    file: Any
+    last_used: float
+    users: int = 0
+    discarded: bool = False
+
+
 class NDSClient:
     """NDS文件传输客户端
 
@@ -92,9 +287,21 @@ class NDSClient:
     SUPPORTED_PROTOCOLS = {"FTP", "SFTP"}
     RETRY_COUNT = 3
     RETRY_DELAY = 1  # 秒
+    READ_BLOCK_SIZE = 1024 * 1024  # 单次从数据连接读取的字节数
+    SCAN_CONCURRENCY = 8  # 扫描时同时列举的目录数
+    SFTP_MAX_REQUESTS = 128  # SFTP单次读取的最大并行块请求数
+    STAT_CACHE_TTL = 5  # stat结果缓存时间(秒)
+    STAT_CACHE_SIZE = 1024  # 每个连接缓存的stat条目上限
+    stat_totals = {"hits": 0, "misses": 0}  # 所有连接的stat缓存统计
+    HANDLE_CACHE_SIZE = 32  # 每个SFTP连接缓存的打开文件句柄上限
+    HANDLE_IDLE_TIMEOUT = 30  # 句柄空闲超时(秒), 超时后关闭
+    handle_totals = {"hits": 0, "opens": 0, "closes": 0}  # 所有连接的句柄缓存统计
+    read_totals: Dict[str, int] = {}  # nds_id -> 累计读取字节数
+    ZIP_TAIL_SIZE = 128 * 1024  # 解析ZIP时尾部预读取的字节数, 不小于最大注释长度加结束记录长度
 
     def __init__(self, protocol: str, host: str, port: int, user: str, passwd: str,
-                 pool_num: Optional[int] = None, nds_id: Optional[str] = None):
+                 pool_num: Optional[int] = None, nds_id: Optional[str] = None,
+                 read_block_size: Optional[int] = None):
         if protocol not in self.SUPPORTED_PROTOCOLS:
             raise NDSError(f"Unsupported protocol: {protocol}", level=1)
 
@@ -105,12 +312,25 @@ class NDSClient:
         self.passwd = passwd
         self.pool_num = pool_num
         self.ID = self.ID = int(nds_id) if nds_id is not None else None
+        self.read_block_size = read_block_size or self.READ_BLOCK_SIZE
+        self.zip_tail_size = self.ZIP_TAIL_SIZE
+        self.scan_stats: Dict[str, Any] = {}
+        self.scan_delta: Dict[str, Any] = {}  # 最近一次增量扫描与上次结果的差异
+        self.stat_cache_ttl = self.STAT_CACHE_TTL
+        self.sftp_max_requests = self.SFTP_MAX_REQUESTS
+        self.stat_counters = {"hits": 0, "misses": 0}
+        self._stat_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}  # path -> (缓存时间, 状态信息)
+        self.handle_cache_size = self.HANDLE_CACHE_SIZE
+        self.handle_idle_timeout = self.HANDLE_IDLE_TIMEOUT
+        self._handles: OrderedDict[str, OpenHandle] = OrderedDict()  # path -> 打开的文件句柄
+        self._opening: Dict[str, asyncio.Future] = {}  # path -> 正在打开的句柄
 
         # 私有属性
         self.__ftp = None
         self.__sftp = None
         self.client = None
         self.__stream = None
+        self.__stream_handle: Optional[OpenHandle] = None
         self.stream_path = None
         self.stream_info: Dict[str, Any] = {}
         self.__stream_offset = 0
@@ -148,7 +368,7 @@ class NDSClient:
                     self.client = await self.__sftp.start_sftp_client()
                 return True
             except Exception as e:
-                if attempt == self.RETRY_COUNT - 1:
+                if attempt == retry - 1:
                     raise NDSConnectError(f"Connect error after {retry} attempts: {str(e)}", level=1)
                 await asyncio.sleep(self.RETRY_DELAY)
 
@@ -194,8 +414,23 @@ class NDSClient:
             logger.warning(f"Connection check failed: {str(e)}")
             return False
 
+    async def keepalive(self) -> bool:
+        """发送一次轻量请求保持连接(FTP: NOOP, SFTP: realpath), 返回连接是否可用"""
+        if not self.client:
+            return False
+        try:
+            if self.protocol == "FTP":
+                await self.client.command("NOOP", "2xx")
+            else:
+                await self.client.realpath('.')
+            return True
+        except Exception as e:
+            logger.debug(f"Keepalive failed: {e}")
+            return False
+
     async def close_connect(self):
         """关闭连接"""
+        await self.close_handles()
         try:
             if self.protocol == "FTP" and self.__ftp:
                 try:
@@ -214,106 +449,407 @@ class NDSClient:
             self.client = None
             self.__ftp = None
             self.__sftp = None
+            self._stat_cache.clear()
+
+    async def list_dir(self, dir_path: str) -> List[Tuple[str, bool, Optional[float]]]:
+        """列举单个目录
+
+        Returns:
+            (完整路径, 是否目录, 修改时间戳) 列表, 不包含 . 和 ..
+        """
+        if self.client is None:
+            raise NDSError("Not init NDS Client", "NDSClient.list_dir", -1)
+        entries = []
+        if self.protocol == "FTP":
+            async for path, info in self.client.list(dir_path, recursive=False):
+                entry_type = info.get('type')
+                if entry_type in ('file', 'dir'):
+                    entries.append((str(path), entry_type == 'dir', parse_mtime(info.get('modify'))))
+        elif self.protocol == "SFTP":
+            for entry in await self.client.readdir(dir_path):
+                if entry.filename in ('.', '..'):
+                    continue
+                entries.append((
+                    f"{dir_path.rstrip('/')}/{entry.filename}",
+                    stat.S_ISDIR(entry.attrs.permissions or 0),
+                    parse_mtime(entry.attrs.mtime)
+                ))
+        else:
+            raise NDSError("Invalid protocol, only support FTP and SFTP", "NDSClient.list_dir", 1)
+        return entries
 
-    async def scan(self, scan_path: str, filter_pattern: Optional[str] = None) -> List[str]:
-        """扫描远程目录并返回文件列表"""
+    async def dir_mtime(self, dir_path: str) -> Optional[float]:
+        """获取目录修改时间戳, 无法获取时返回None"""
+        try:
+            info = await self.client.stat(dir_path)
+        except Exception as e:
+            logger.warning(f"Stat directory {dir_path} error: {e}")
+            return None
+        return parse_mtime(info.get('modify') if self.protocol == "FTP" else info.mtime)
+
+    async def walk(self, scan_path: str, concurrency: Optional[int] = None,
+                   peers: Optional[List["NDSClient"]] = None,
+                   snapshot: Optional[ScanSnapshot] = None,
+                   dir_filter: Optional[Callable[[str], bool]] = None) -> AsyncIterator[Tuple[str, List[str]]]:
+        """并发遍历远程目录树, 每列举完一个目录即返回其中的文件
+
+        SFTP在同一会话上并发发送多个目录请求; FTP每条连接同一时间只能列举一个目录,
+        由 peers 提供额外的连接, 并发数不超过连接数.
+        提供 snapshot 时, 修改时间未变化的目录直接使用快照内容, 只对其子目录获取修改时间
+
+        Args:
+            scan_path: 扫描根目录
+            concurrency: 同时列举的目录数上限, 默认SCAN_CONCURRENCY
+            peers: 同一NDS的其他已连接客户端(仅FTP使用)
+            snapshot: 目录快照, 为None时完整列举
+            dir_filter: 子目录过滤函数, 返回False的目录不再遍历
+        Yields:
+            (目录路径, 该目录下的文件路径列表)
+        """
+        if self.client is None:
+            raise NDSError("Not init NDS Client", "NDSClient.walk", -1)
+        concurrency = max(concurrency or self.SCAN_CONCURRENCY, 1)
+        if self.protocol == "FTP":
+            clients = [self] + [peer for peer in (peers or []) if peer is not self and peer.client]
+            clients = clients[:concurrency]
+        else:
+            clients = [self] * concurrency
+
+        pending: asyncio.Queue = asyncio.Queue()
+        results: asyncio.Queue = asyncio.Queue()
+
+        async def worker(client: "NDSClient"):
+            while True:
+                dir_path, mtime = await pending.get()
+                try:
+                    if snapshot is not None:
+                        if mtime is None:
+                            mtime = await client.dir_mtime(dir_path)
+                        cached = snapshot.lookup(dir_path, mtime)
+                        if cached is not None:
+                            await results.put((dir_path, cached.entries, None, True))
+                            continue
+                    entries = await client.list_dir(dir_path)
+                    if snapshot is not None:
+                        snapshot.store(dir_path, mtime, entries)
+                    await results.put((dir_path, entries, None, False))
+                except Exception as err:
+                    if client.protocol == "FTP":
+                        await client.close_connect()  # 列举中断后FTP连接状态不可靠
+                    await results.put((dir_path, None, err, False))
+                    return
+                except BaseException:
+                    # 遍历被取消时正在列举的FTP连接可能残留未读完的数据连接与应答
+                    if client.protocol == "FTP":
+                        await client.close_connect()
+                    raise
+
+        stats = self.scan_stats = {
+            "path": scan_path,
+            "workers": len(clients),
+            "directories": 0,
+            "cached_directories": 0,
+            "pruned_directories": 0,
+            "files": 0,
+            "duration": 0.0,
+            "finished": False
+        }
+        start_time = time.monotonic()
+        workers = [asyncio.create_task(worker(client)) for client in clients]
+        pending.put_nowait((scan_path, None))
+        outstanding = 1
+        try:
+            while outstanding:
+                dir_path, entries, error, cached = await results.get()
+                outstanding -= 1
+                if error is not None:
+                    raise error
+                files = []
+                for full_path, is_dir, mtime in entries:
+                    if is_dir:
+                        if dir_filter is not None and not dir_filter(full_path):
+                            stats["pruned_directories"] += 1
+                            continue
+                        # 快照中子目录的修改时间可能已过期, 需重新获取
+                        pending.put_nowait((full_path, None if cached else mtime))
+                        outstanding += 1
+                    else:
+                        files.append(full_path)
+                stats["directories"] += 1
+                stats["cached_directories"] += 1 if cached else 0
+                stats["files"] += len(files)
+                yield dir_path, files
+            stats["finished"] = True
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            stats["duration"] = round(time.monotonic() - start_time, 3)
+
+    async def iter_scan(self, scan_path: str, filter_pattern: Optional[str] = None,
+                        concurrency: Optional[int] = None, peers: Optional[List["NDSClient"]] = None,
+                        snapshot: Optional[ScanSnapshot] = None,
+                        time_filter: Optional[ScanTimeFilter] = None) -> AsyncIterator[Tuple[str, List[str]]]:
+        """扫描远程目录, 每列举完一个目录即返回其中匹配的文件
+
+        提供 snapshot 时增量扫描, 完整遍历结束后将结果提交到快照;
+        提供 time_filter 时剪枝时间窗口外的目录与文件, 此时结果不完整, 快照只更新目录列举
+
+        Yields:
+            (目录路径, 匹配的文件路径列表), 不返回没有匹配文件的目录
+        """
         if not scan_path:
             raise NDSError("Invalid scan path", level=1)
 
-        files = []
         use_filter = True if filter_pattern and is_regex(filter_pattern) else False
         if filter_pattern and not use_filter:
             raise NDSError("Scanner filter error", level=1)
 
         if self.client is None:
             raise NDSError("Not init NDS Client", "NDSClient.scan", -1)
-
-        if self.protocol == "FTP":
-
-            try:
-                async for path, info in self.client.list(scan_path, recursive=True):
-                    if info.get('type') == 'file':
-                        if use_filter:
-                            if re.search(filter_pattern, str(path)):
-                                files.append(str(path))
-                        else:
-                            files.append(str(path))
-            except Exception as e:
-                await self.close_connect()
-                raise e
-
-        elif self.protocol == "SFTP":
-            #  使用队列方式代替函数递归
-            stack = [scan_path]
-            while stack:
-                current_path = stack.pop()
-                async for entry in self.client.scandir(current_path):
-                    full_path = f"{current_path.rstrip('/')}/{entry.filename}"
-                    if stat.S_ISDIR(entry.attrs.permissions):
-                        stack.append(full_path)
-                    else:
-                        if use_filter:
-                            if re.search(filter_pattern, str(full_path)):
-                                files.append(str(full_path))
-                        else:
-                            files.append(str(full_path))
-        else:
+        if self.protocol not in self.SUPPORTED_PROTOCOLS:
             raise NDSError("Invalid protocol, only support FTP and SFTP", "NDSClient.scan", 1)
+
+        pattern = re.compile(filter_pattern) if use_filter else None
+        dir_filter = time_filter.accept_dir if time_filter else None
+        files = []
+        pruned = 0
+        try:
+            async for dir_path, names in self.walk(scan_path, concurrency, peers, snapshot, dir_filter):
+                matched = [name for name in names if not pattern or pattern.search(name)]
+                if time_filter is not None:
+                    in_window = [name for name in matched if time_filter.accept_file(name)]
+                    pruned += len(matched) - len(in_window)
+                    matched = in_window
+                if matched:
+                    files.extend(matched)
+                    yield dir_path, matched
+        except BaseException:
+            if snapshot is not None:
+                snapshot.abort()
+            raise
+        self.scan_stats["matched"] = len(files)
+        self.scan_stats["pruned_files"] = pruned
+        if snapshot is not None and time_filter is not None:
+            snapshot.abort()  # 剪枝后的结果不完整, 不更新文件集合与令牌
+        elif snapshot is not None:
+            self.scan_delta = snapshot.commit(files)
+            self.scan_stats["added"] = len(self.scan_delta["added"])
+            self.scan_stats["removed"] = len(self.scan_delta["removed"])
+
+    async def scan(self, scan_path: str, filter_pattern: Optional[str] = None,
+                   concurrency: Optional[int] = None, peers: Optional[List["NDSClient"]] = None,
+                   snapshot: Optional[ScanSnapshot] = None,
+                   time_filter: Optional[ScanTimeFilter] = None) -> List[str]:
+        """扫描远程目录并返回文件列表
+
+        提供 snapshot 时增量扫描, 扫描完成后将结果提交到快照
+        """
+        files = []
+        async for _, matched in self.iter_scan(scan_path, filter_pattern, concurrency, peers, snapshot, time_filter):
+            files.extend(matched)
         return files
 
     async def file_exists(self, remote_path: str) -> bool:
         """检查远程文件是否存在"""
-        try:
-            await self.client.stat(remote_path)
-            return True
-        except FileNotFoundError:
-            return False
-        except Exception as e:
-            raise NDSError(str(e), f"NDSClient.file_exists remote_path:{remote_path}", 1)
+        return await self.stat(remote_path) is not None
+
+    async def stat(self, file_path: str, use_cache: bool = True) -> Optional[Dict[str, Any]]:
+        """获取文件状态信息
+
+        每次只发送一次stat请求, 成功结果按 STAT_CACHE_TTL 缓存在当前连接上
+
+        Args:
+            file_path: 文件路径
+            use_cache: 是否使用缓存结果
+        Returns:
+            文件状态信息, 文件不存在时返回None
+        Raises:
+            NDSIOError: 连接或协议错误
+        """
+        now = time.monotonic()
+        if use_cache:
+            cached = self._stat_cache.get(file_path)
+            if cached and now - cached[0] <= self.stat_cache_ttl:
+                self._count_stat(True)
+                self.stream_info = dict(cached[1])
+                return self.stream_info
+        self._count_stat(False)
 
-    async def stat(self, file_path: str) -> Optional[Dict[str, Any]]:
-        """获取文件状态信息"""
         try:
-            if not await self.file_exists(file_path):
-                return None
             info_obj = await self.client.stat(file_path)
-            if not info_obj:
-                return None
-
-            if self.protocol == "FTP":
-                info = info_obj
-                modify = info.get('modify')
-                modify = datetime(
-                    int(modify[:4]), int(modify[4:6]), int(modify[6:8]),
-                    int(modify[8:10]), int(modify[10:12]), int(modify[12:14]), 0
-                ).strftime('%Y-%m-%d %H:%M:%S') if modify else modify
-            elif self.protocol == "SFTP":
-                info = {attr: getattr(info_obj, attr, None) for attr in dir(info_obj) if not attr.startswith('_')}
-                modify = info.get('modify')
-                modify = datetime.fromtimestamp(modify).strftime('%Y-%m-%d %H:%M:%S') if modify else modify
-            else:
+        except Exception as e:
+            # 只有明确的不存在(FTP 550)才返回None, 其他状态码属于暂时性错误
+            if isinstance(self._read_error(e, file_path, "NDSClient.stat"), NDSFileNotFoundError):
+                self._stat_cache.pop(file_path, None)
                 return None
+            raise NDSIOError(f"Stat {file_path} error: {e}", "NDSClient.stat", 1)
+        if not info_obj:
+            return None
 
-            self.stream_info = {
-                "file_path": file_path,
-                "directory": file_path.rsplit('/', 1)[0],
-                "filename": file_path.rsplit('/', 1)[1],
-                "size": int(info.get('size')),
-                "modify": modify
-            }
-            return self.stream_info
-        except Exception as e:
+        if self.protocol == "FTP":
+            size = info_obj.get('size')
+            modify = info_obj.get('modify')
+            modify = datetime(
+                int(modify[:4]), int(modify[4:6]), int(modify[6:8]),
+                int(modify[8:10]), int(modify[10:12]), int(modify[12:14]), 0
+            ).strftime('%Y-%m-%d %H:%M:%S') if modify else modify
+        elif self.protocol == "SFTP":
+            size = info_obj.size
+            modify = info_obj.mtime
+            modify = datetime.fromtimestamp(modify).strftime('%Y-%m-%d %H:%M:%S') if modify else modify
+        else:
             return None
 
-    async def open(self, file_path):
+        self.stream_info = {
+            "file_path": file_path,
+            "directory": file_path.rsplit('/', 1)[0],
+            "filename": file_path.rsplit('/', 1)[1],
+            "size": int(size or 0),
+            "modify": modify
+        }
+        if len(self._stat_cache) >= self.STAT_CACHE_SIZE:
+            self._stat_cache.pop(next(iter(self._stat_cache)))
+        self._stat_cache[file_path] = (now, dict(self.stream_info))
+        return self.stream_info
+
+    def _count_stat(self, hit: bool) -> None:
+        key = "hits" if hit else "misses"
+        self.stat_counters[key] += 1
+        NDSClient.stat_totals[key] += 1
+
+    @classmethod
+    def get_stat_status(cls) -> Dict[str, Any]:
+        """获取所有连接的stat缓存命中统计"""
+        lookups = cls.stat_totals["hits"] + cls.stat_totals["misses"]
+        return {
+            **cls.stat_totals,
+            "hit_rate": round(cls.stat_totals["hits"] / lookups, 4) if lookups else 0.0
+        }
 
-        self.stream_info = await self.stat(file_path)
-        if not self.stream_info:
+    async def open(self, file_path):
+        """打开文件, 文件状态来自stat缓存"""
+        stream_info = await self.stat(file_path)
+        if not stream_info:
             raise NDSFileNotFoundError(f"File not found: {file_path}")
         if self.protocol == "SFTP":
-            self.__stream = await self.client.open(file_path, 'rb')
+            self._release_stream()
+            self.__stream_handle = await self._acquire_handle(file_path)
+            self.__stream = self.__stream_handle.file
         self.stream_path = file_path
 
+    def _release_stream(self) -> None:
+        """释放当前打开文件占用的句柄, 句柄保留在缓存中"""
+        if self.__stream_handle is not None:
+            self._release_handle(self.__stream_handle)
+        self.__stream_handle = None
+        self.__stream = None
+
+    async def _acquire_handle(self, file_path: str) -> OpenHandle:
+        """从句柄缓存获取SFTP文件句柄, 未命中时打开文件, 使用完毕须调用_release_handle"""
+        await self.expire_handles()
+        handle = self._handles.get(file_path)
+        if handle is None and file_path in self._opening:
+            handle = await asyncio.shield(self._opening[file_path])  # 同一文件正在打开, 等待并复用其句柄
+            self._count_handle("hits")
+        elif handle is None:
+            opening = self._opening[file_path] = asyncio.get_running_loop().create_future()
+            opening.add_done_callback(lambda f: f.cancelled() or f.exception())
+            try:
+                remote_file = await self.client.open(file_path, 'rb', max_requests=self.sftp_max_requests)
+                self._count_handle("opens")
+                handle = self._handles[file_path] = OpenHandle(file=remote_file, last_used=time.monotonic())
+                opening.set_result(handle)
+            except BaseException as e:
+                opening.set_exception(e if isinstance(e, Exception) else NDSIOError(f"Open {file_path} cancelled"))
+                raise
+            finally:
+                self._opening.pop(file_path, None)
+        else:
+            self._handles.move_to_end(file_path)
+            self._count_handle("hits")
+        handle.users += 1
+        handle.last_used = time.monotonic()
+        await self._evict_handles()
+        return handle
+
+    def _release_handle(self, handle: OpenHandle) -> None:
+        handle.users -= 1
+        handle.last_used = time.monotonic()
+        if handle.discarded and handle.users == 0:
+            asyncio.ensure_future(self._close_handle_file(handle.file))
+
+    def _discard_handle(self, file_path: str, handle: OpenHandle) -> None:
+        """句柄读取出错时移出缓存, 最后一个使用者释放后关闭"""
+        if self._handles.get(file_path) is handle:
+            del self._handles[file_path]
+        handle.discarded = True
+
+    @asynccontextmanager
+    async def _cached_file(self, file_path: str):
+        """使用缓存的SFTP文件句柄"""
+        handle = await self._acquire_handle(file_path)
+        try:
+            yield handle.file
+        except Exception:
+            self._discard_handle(file_path, handle)
+            raise
+        finally:
+            self._release_handle(handle)
+
+    async def _evict_handles(self) -> None:
+        """超出缓存上限时按最久未使用顺序关闭空闲句柄, 使用中的句柄不会被关闭"""
+        excess = len(self._handles) - self.handle_cache_size
+        if excess <= 0:
+            return
+        await self._close_idle_handles([path for path, handle in self._handles.items() if handle.users == 0][:excess])
+
+    async def expire_handles(self) -> None:
+        """关闭空闲超时的句柄"""
+        deadline = time.monotonic() - self.handle_idle_timeout
+        await self._close_idle_handles([path for path, handle in self._handles.items()
+                                        if handle.users == 0 and handle.last_used < deadline])
+
+    async def _close_idle_handles(self, paths: List[str]) -> None:
+        """先同步移出全部空闲句柄再关闭, 关闭期间并发的读取不会取到或重复移出这些句柄"""
+        victims = []
+        for path in paths:
+            handle = self._handles.get(path)
+            if handle is not None and handle.users == 0:
+                victims.append(self._handles.pop(path))
+        if victims:
+            await asyncio.gather(*(self._close_handle_file(handle.file) for handle in victims))
+
+    async def close_handles(self) -> None:
+        """关闭全部缓存的句柄"""
+        handles = list(self._handles.values())
+        self._handles.clear()
+        self.__stream_handle = None
+        self.__stream = None
+        if handles and self.client is not None:
+            await asyncio.gather(*(self._close_handle_file(handle.file) for handle in handles))
+
+    async def _close_handle_file(self, remote_file) -> None:
+        self._count_handle("closes")
+        try:
+            await remote_file.close()
+        except Exception as e:
+            logger.debug(f"Close remote file error: {e}")
+
+    @staticmethod
+    def _count_handle(key: str) -> None:
+        NDSClient.handle_totals[key] += 1
+
+    @classmethod
+    def get_handle_status(cls) -> Dict[str, Any]:
+        """获取所有连接的文件句柄缓存统计"""
+        lookups = cls.handle_totals["hits"] + cls.handle_totals["opens"]
+        return {
+            **cls.handle_totals,
+            "open": cls.handle_totals["opens"] - cls.handle_totals["closes"],
+            "hit_rate": round(cls.handle_totals["hits"] / lookups, 4) if lookups else 0.0
+        }
+
     async def seek(self, offset: int = 0, whence: int = 0) -> None:
         """设置文件指针位置
 
@@ -334,6 +870,45 @@ class NDSClient:
                 else offset
             )
 
+    def _resolve_size(self, size: Optional[int]) -> int:
+        """根据当前偏移量计算实际可读取的字节数"""
+        remain = max(self.stream_info['size'] - self.__stream_offset, 0)
+        return size if size and size <= remain else remain
+
+    async def _ftp_read(self, file_path: str, offset: int, size: int) -> bytearray:
+        """FTP读取: 大块读取数据连接并直接写入预分配缓冲区
+
+        Args:
+            file_path: 文件路径
+            offset: 起始位置
+            size: 读取的字节数
+        Returns:
+            读取的字节数据, 数据不足时截断为实际长度
+        """
+        buffer = bytearray(size)
+        if size <= 0:
+            return buffer
+        view = memoryview(buffer)
+        pos = 0
+        stream = await self.client.get_stream(
+            "RETR " + file_path,
+            ('1xx', '200', '250'),  # 接受更多有效的FTP响应码
+            offset=offset
+        )
+        try:
+            while pos < size:
+                block = await stream.read(min(size - pos, self.read_block_size))
+                if not block:
+                    break
+                view[pos:pos + len(block)] = block
+                pos += len(block)
+        finally:
+            view.release()
+            await stream.finish('xxx')
+        if pos < size:
+            del buffer[pos:]  # 原地截断, 不产生额外拷贝
+        return buffer
+
     async def read(self, size: Optional[int] = None, offset: Optional[int] = None) -> bytes:
         """读取文件内容
 
@@ -341,7 +916,7 @@ class NDSClient:
             size: 要读取的字节数, None表示读取到文件末尾
             offset: 偏移量(0:开始, 1:当前, 2:结尾), None表示不设置偏移量, 可配合seek使用
         Returns:
-            读取的字节数据
+            读取的字节数据(FTP为bytearray, 避免额外拷贝)
         Raises:
             NDSIOError: 读取过程中发生错误
         """
@@ -353,49 +928,43 @@ class NDSClient:
             await self.seek(offset)
 
         async with self._lock:
+            size = self._resolve_size(size)
             if self.protocol == "FTP":
                 try:
-                    stream = await self.client.get_stream(
-                        "RETR " + self.stream_path,
-                        ('1xx', '200', '250'),  # 接受更多有效的FTP响应码
-                        offset=self.__stream_offset
-                    )
-                    tmp_io = BytesIO()
-                    size = size if size and self.__stream_offset + size <= self.stream_info['size'] else \
-                        self.stream_info['size'] - self.__stream_offset
-                    total = size
-                    offset = self.__stream_offset
-                    while total > 0:
-                        block = await stream.read(min(abs(total), 2048))
-                        if not block:
-                            break
-                        tmp_io.write(block)
-                        total -= len(block)
-                        offset += len(block)
-                        if size and tmp_io.tell() >= size:
-                            await stream.finish('xxx')
-                            break
-                    self.__stream_offset = self.__stream_offset + size if size else self.stream_info["size"]
-                    return tmp_io.getvalue()[0:size]
+                    data = await self._ftp_read(self.stream_path, self.__stream_offset, size)
                 except Exception as e:
                     raise NDSError(f'read warning: {e}', "NDSClient.read", -1)
             elif self.protocol == "SFTP":
                 if self.__stream is None:
                     raise NDSError("File is not open", "NDSClient.read", 1)
                 try:
-                    size = size if size and self.__stream_offset + size <= self.stream_info['size'] else \
-                        self.stream_info['size'] - self.__stream_offset
                     data = await self.__stream.read(size, self.__stream_offset)
-                    self.__stream_offset = self.__stream_offset + size if size else self.stream_info['size']
                 except Exception as e:
                     raise NDSError(f'read warning: {e}', "NDSClient.read", -1)
-                return data
             else:
                 raise NDSError("Invalid protocol, only support FTP and SFTP", "NDSClient.read", 1)
+            self.__stream_offset += size
+            return data
+
+    async def _read_at(self, offset: int, size: int) -> bytes:
+        """从指定位置读取当前打开文件的内容"""
+        await self.seek(offset, 0)
+        return await self.read(size)
+
+    async def _read_local_header_size(self, offset: int) -> int:
+        """读取本地文件头并返回其完整长度(含文件名与扩展字段)"""
+        data = await self._read_at(offset, ZIP_HEADER_SIZE)
+        if len(data) != ZIP_HEADER_SIZE or data[0:4] != ZIP_MAGIC:
+            raise NDSZipError(f"Bad local file header at {offset}", "NDSClient.get_zip_info", 1)
+        header = struct.unpack(ZIP_HEADER_STRUCT, data)
+        return ZIP_HEADER_SIZE + header[10] + header[11]
 
     async def get_zip_info(self, file_path: str = None) -> list[KeyType[Any, Any]]:
         """解析ZIP文件结构并返回文件信息列表
 
+        通过一次尾部预读取获得结束记录与中央目录(目录超出预读范围时补读一次),
+        支持带注释的ZIP与ZIP64, 各子文件的数据偏移按条目单独计算
+
         Args:
             file_path: 文件路径, 为None时使用当前打开的文件
         Returns:
@@ -405,94 +974,98 @@ class NDSClient:
         """
         if file_path:
             await self.open(file_path)
-        # 读取文件头
-        header_str = b"PK\003\004"  # ZIP文件的魔术数字
-        header_struct = "<4s2B4HL2L2H"  # ZIP文件的本地文件头格式
-        header_size = struct.calcsize(header_struct)
-        await self.seek(0, 0)
-        tmp_data = await self.read(header_size)
-        header_data = struct.unpack(header_struct, tmp_data)
-        if len(tmp_data) != header_size or header_data[0] != header_str:
-            raise Exception("ZIP header warning")
-        self.stream_info['header_size'] = header_data[10] + header_data[11] + header_size
-        # 解析中央目录结构
-        cd_end_struct = b"<4s4H2LH"  # structEndArchive
-        cd_end_str = b"PK\005\006"  # stringEndArchive
-        cd_end_size = struct.calcsize(cd_end_struct)  # sizeEndCentDir
-        await self.seek(cd_end_size, 2)
-        tmp_data = await self.read()
-        if len(tmp_data) != cd_end_size or tmp_data[0:4] != cd_end_str or tmp_data[-2:] != b"\000\000":
-            raise Exception("ZIP CentDirectory warning")  # 要么不是ZIP文件，要么带了注释，暂时不解决注释问题
-        cd_rec = struct.unpack(cd_end_struct, tmp_data)
-        cd_rec = list(cd_rec)
-        cd_rec.append(b"")
-        cd_rec.append(self.stream_info['size'] - cd_end_size)
-        # 尝试读取ZIP64中央目录文件(用于兼容ZIP64)
-        cd_end_64_struct = "<4sQ2H2L4Q"  # structEndArchive64
-        cd_end_64_str = b"PK\x06\x06"  # stringEndArchive64
-        cd_end_64_size = struct.calcsize(cd_end_64_struct)  # sizeEndCentDir64
-        cd_end_l64_struct = "<4sLQL"  # structEndArchive64Locator
-        cd_end_l64_str = b"PK\x06\x07"  # stringEndArchive64Locator
-        cd_end_l64_size = struct.calcsize(cd_end_l64_struct)  # sizeEndCentDir64Locator
-        if cd_end_size + cd_end_l64_size < self.stream_info['size']:
-            await self.seek(-cd_end_size - cd_end_l64_size, 2)
-            tmp_data = await self.read(cd_end_l64_size)
-            if len(tmp_data) == cd_end_l64_str:
-                sig, disk_no, rel_off, disks = struct.unpack(cd_end_l64_struct, tmp_data)
-                if sig == cd_end_l64_str:
-                    if disk_no != 0 or disks > 1:
-                        raise Exception("ZIP Files that span multiple disks are not supported")
-                    # Assume no 'zip64 extensible data'
-                    await self.seek(-cd_end_64_size - cd_end_l64_size - cd_end_64_size, 2)
-                    if len(tmp_data) == cd_end_64_size:
-                        sig, sz, create_version, read_version, disk_num, disk_dir, \
-                            dir_count, dir_count2, dir_size, dir_offset = \
-                            struct.unpack(cd_end_64_struct, tmp_data)
-                        if sig == cd_end_64_str:
-                            # 更新为ZIP64中央目录结构
-                            cd_rec[0] = sig  # _ECD_SIGNATURE
-                            cd_rec[1] = disk_num  # _ECD_DISK_NUMBER
-                            cd_rec[2] = disk_dir  # _ECD_DISK_START
-                            cd_rec[3] = dir_count  # _ECD_ENTRIES_THIS_DISK
-                            cd_rec[4] = dir_count2  # _ECD_ENTRIES_TOTAL
-                            cd_rec[5] = dir_size  # _ECD_SIZE
-                            cd_rec[6] = dir_offset  # _ECD_OFFSET
-        cd_end_size = cd_rec[5]  # _ECD_SIZE 中央目录字节尺寸
-        cd_offset = cd_rec[6]  # _ECD_OFFSET 中央目录开始位置
-        concat = cd_rec[9] - cd_end_size - cd_offset  # _ECD_LOCATION = 9
-        concat -= (cd_end_64_size + cd_end_l64_size) if cd_rec[0] == cd_end_64_str else 0  # ZIP64扩展结构
-        offset = cd_offset + concat
-        await self.seek(offset, 0)
-        tmp_data = await self.read(cd_end_size)
-        data = BytesIO(tmp_data)
-        cd_dir_struct = "<4s4B4HL2L5H2L"  # structCentralDir
-        cd_dir_str = b"PK\001\002"  # stringCentralDir
-        cd_dir_size = struct.calcsize(cd_dir_struct)  # sizeCentralDir
-        total = 0
+        file_size = self.stream_info['size']
+
+        # 1. 尾部预读取, 长度覆盖最大注释, 通常也能覆盖整个中央目录
+        base = max(file_size - self.zip_tail_size, 0)
+        buffer = await self._read_at(base, file_size - base)
+        end_pos = find_end_record(buffer)
+        max_tail = ZIP_MAX_COMMENT + ZIP_END_SIZE
+        if end_pos < 0 and 0 < base and file_size - base < max_tail:
+            # 预读取长度不足以覆盖注释时, 补读至最大注释长度
+            head_start = max(file_size - max_tail, 0)
+            buffer = await self._read_at(head_start, base - head_start) + buffer
+            base = head_start
+            end_pos = find_end_record(buffer)
+        if end_pos < 0:
+            raise NDSZipError("ZIP end of central directory not found", "NDSClient.get_zip_info", 1)
+        end_rec = struct.unpack_from(ZIP_END_STRUCT, buffer, end_pos)
+        dir_count, dir_size, dir_offset = end_rec[4], end_rec[5], end_rec[6]
+        end_offset = base + end_pos
+
+        # 2. ZIP64: 定位器紧邻结束记录之前, ZIP64结束记录紧邻定位器之前
+        zip64_size = 0
+        locator_pos = end_pos - ZIP64_LOCATOR_SIZE
+        if locator_pos >= 0 and buffer[locator_pos:locator_pos + 4] == ZIP64_LOCATOR:
+            _, disk_no, _, disks = struct.unpack_from(ZIP64_LOCATOR_STRUCT, buffer, locator_pos)
+            if disk_no != 0 or disks > 1:
+                raise NDSZipError("ZIP Files that span multiple disks are not supported", "NDSClient.get_zip_info", 1)
+            rec_offset = end_offset - ZIP64_LOCATOR_SIZE - ZIP64_END_SIZE
+            if rec_offset >= base:
+                rec_data = buffer[rec_offset - base:rec_offset - base + ZIP64_END_SIZE]
+            else:
+                rec_data = await self._read_at(rec_offset, ZIP64_END_SIZE)
+            if len(rec_data) != ZIP64_END_SIZE or rec_data[0:4] != ZIP64_MAGIC:
+                raise NDSZipError("ZIP64 end of central directory not found", "NDSClient.get_zip_info", 1)
+            rec = struct.unpack(ZIP64_END_STRUCT, rec_data)
+            dir_count, dir_size, dir_offset = rec[7], rec[8], rec[9]
+            zip64_size = ZIP64_LOCATOR_SIZE + ZIP64_END_SIZE
+
+        # 3. 定位中央目录, concat为ZIP前附加数据的长度
+        dir_start = end_offset - zip64_size - dir_size
+        if dir_start < 0:
+            raise NDSZipError("Bad central directory size", "NDSClient.get_zip_info", 1)
+        concat = dir_start - dir_offset
+        if dir_start < base:
+            buffer = await self._read_at(dir_start, base - dir_start) + buffer
+            base = dir_start
+        entries = parse_central_directory(buffer, dir_start - base, dir_size, concat)
+        if dir_count and len(entries) != dir_count:
+            logger.warning(f"ZIP entry count mismatch {self.stream_path}: {len(entries)} != {dir_count}")
+
+        # 4. 计算各子文件数据偏移
+        descriptor_size = None
+        extra_size = None  # 实际读取到的本地文件头比(固定部分 + 文件名)多出的长度, 即该包的扩展字段布局
+        ordered = sorted(entries, key=lambda item: item['local_offset'])
+        for index, entry in enumerate(ordered):
+            local_offset = entry['local_offset']
+            boundary = ordered[index + 1]['local_offset'] if index + 1 < len(ordered) else dir_start
+            min_size = ZIP_HEADER_SIZE + entry['name_length']
+            header_size = None
+            if base <= local_offset and local_offset + ZIP_HEADER_SIZE <= base + len(buffer):
+                # 本地文件头位于已读取的缓冲区中, 直接解析
+                pos = local_offset - base
+                if buffer[pos:pos + 4] == ZIP_MAGIC:
+                    header = struct.unpack_from(ZIP_HEADER_STRUCT, buffer, pos)
+                    header_size = ZIP_HEADER_SIZE + header[10] + header[11]
+                    extra_size = header_size - min_size
+            if header_size is None:
+                # 子文件在ZIP中连续存放: 头长度 = 下一条目起点 - 起点 - 数据长度 - 数据描述符长度
+                gap = boundary - local_offset - entry['compress_size']
+                if not entry['flag_bits'] & ZIP_FLAG_DATA_DESCRIPTOR:
+                    header_size = gap
+                elif descriptor_size is not None:
+                    header_size = gap - descriptor_size
+                if extra_size is None or header_size != min_size + extra_size:
+                    # 推算结果与已读取的头部布局不一致(条目间有填充、数据描述符不规则等)或尚无样本时,
+                    # 读取本地文件头校验签名并以其实际长度为准, 同时确定该包数据描述符的长度
+                    header_size = await self._read_local_header_size(local_offset)
+                    extra_size = header_size - min_size
+                    if entry['flag_bits'] & ZIP_FLAG_DATA_DESCRIPTOR and gap - header_size in ZIP_DESCRIPTOR_SIZES:
+                        descriptor_size = gap - header_size
+            entry['header_offset'] = local_offset + header_size
+
+        directory, file_name = os.path.split(self.stream_path)
         file_info_array = []
-        while total < cd_end_size:
-            centdir = data.read(cd_dir_size)
-            if len(centdir) != cd_dir_size:
-                raise Exception("Truncated central directory")
-            centdir = struct.unpack(cd_dir_struct, centdir)
-            if centdir[0] != cd_dir_str:  # _CD_SIGNATURE = 0
-                raise Exception("Bad magic number for central directory")
-            if centdir[3] > 63:  # centdir[3]: extract_version, MAX_EXTRACT_VERSION = 63, 目前支持6.3及以下版本的ZIP包
-                raise Exception("zip file version %.1f" % (centdir[3] / 10))
-
+        for entry in entries:
             info = KeyType()
-            info.directory, info.file_name = os.path.split(self.stream_path)
-            info.sub_file_name = data.read(centdir[12])  # _CD_FILENAME_LENGTH = 12
-            flags = centdir[5]  # _CD_FLAG_BITS = 5
-            # _MASK_UTF_FILENAME = 1 << 11 = 2048
-            info.sub_file_name = info.sub_file_name.decode('utf-8') if flags & 2048 else info.sub_file_name.decode(
-                'cp437')
-            # _CD_LOCAL_HEADER_OFFSET 文件开始位置，需要加上文件头尺寸
-            info.header_offset = centdir[18] + self.stream_info['header_size']
-            info.compress_size = centdir[10]
-            info.file_size = centdir[11]
-            info.flag_bits = centdir[5]
-            info.compress_type = centdir[6]
+            info.directory, info.file_name = directory, file_name
+            info.sub_file_name = entry['sub_file_name']
+            info.header_offset = entry['header_offset']
+            info.compress_size = entry['compress_size']
+            info.file_size = entry['file_size']
+            info.flag_bits = entry['flag_bits']
+            info.compress_type = entry['compress_type']
 
             #  定制化处理，MRO/MDT eNB ID提取
             match = re.search(r"_(\d{6,8})_", info.sub_file_name)
@@ -501,11 +1074,6 @@ class NDSClient:
             else:
                 info.enodebid = 0
             file_info_array.append(info)
-            #  使用read跳过部分无需读取的数据信息
-            # _CD_EXTRA_FIELD_LENGTH = 13 // 额外字段信息
-            # _CD_COMMENT_LENGTH = 14 // 注释
-            data.seek(centdir[13] + centdir[14], 1)
-            total = total + cd_dir_size + centdir[12] + centdir[13] + centdir[14]
         return file_info_array
 
     @asynccontextmanager
@@ -525,6 +1093,116 @@ class NDSClient:
             if not await self.check_connect():
                 await self.connect()
 
+    async def read_range(self, file_path: str, offset: int = 0, size: Optional[int] = None) -> bytes:
+        """读取文件指定区间, 不使用也不修改打开文件的读取位置
+
+        SFTP不加锁, 同一会话可同时进行多个读取, 单次读取由asyncssh拆分为并行的块请求,
+        文件句柄缓存在连接上, 同一文件的后续读取不再重复打开;
+        FTP每条连接同一时间只能进行一次传输, 读取时加锁
+
+        Args:
+            file_path: 文件路径
+            offset: 起始位置
+            size: 要读取的字节数, None表示读取到文件末尾
+        Returns:
+            读取的字节数据, 超出文件末尾时截断
+        Raises:
+            NDSFileNotFoundError: 文件不存在
+            NDSIOError: 读取过程中发生错误
+        """
+        if self.client is None:
+            raise NDSError("Not init NDS Client", "NDSClient.read_range", -1)
+        if size is None:
+            info = await self.stat(file_path)
+            if not info:
+                raise NDSFileNotFoundError(f"File not found: {file_path}", "NDSClient.read_range", 1)
+            size = max(info['size'] - offset, 0)
+        if size <= 0:
+            return b""
+        try:
+            if self.protocol == "FTP":
+                async with self._lock:
+                    data = await self._ftp_read(file_path, offset, size)
+            else:
+                async with self._cached_file(file_path) as remote_file:
+                    data = await remote_file.read(size, offset)
+        except Exception as e:
+            raise self._read_error(e, file_path, "NDSClient.read_range")
+        self._count_read(len(data))
+        return data
+
+    async def iter_range(self, file_path: str, offset: int = 0, size: Optional[int] = None,
+                         chunk_size: Optional[int] = None) -> AsyncIterator[bytes]:
+        """按块读取文件指定区间, 数据到达即返回, 不使用也不修改打开文件的读取位置
+
+        调用方取走一块后才读取下一块, 传输速度由调用方的消费速度决定;
+        FTP传输未读完即中止时数据连接状态不确定, 会断开当前连接
+
+        Args:
+            file_path: 文件路径
+            offset: 起始位置
+            size: 要读取的字节数, None表示读取到文件末尾
+            chunk_size: 单块最大字节数, 默认为read_block_size
+        Yields:
+            读取到的数据块
+        Raises:
+            NDSFileNotFoundError: 文件不存在
+            NDSIOError: 读取过程中发生错误
+        """
+        if self.client is None:
+            raise NDSError("Not init NDS Client", "NDSClient.iter_range", -1)
+        if size is None:
+            info = await self.stat(file_path)
+            if not info:
+                raise NDSFileNotFoundError(f"File not found: {file_path}", "NDSClient.iter_range", 1)
+            size = max(info['size'] - offset, 0)
+        chunk_size = chunk_size or self.read_block_size
+        pos = 0
+        try:
+            if self.protocol == "FTP":
+                async with self._lock:
+                    stream = await self.client.get_stream("RETR " + file_path, ('1xx', '200', '250'), offset=offset)
+                    finished = False
+                    try:
+                        while pos < size:
+                            block = await stream.read(min(size - pos, chunk_size))
+                            if not block:
+                                break
+                            pos += len(block)
+                            self._count_read(len(block))
+                            yield block
+                        finished = True
+                    finally:
+                        if finished:
+                            await stream.finish('xxx')
+                        else:
+                            await self.close_connect()
+            else:
+                async with self._cached_file(file_path) as remote_file:
+                    while pos < size:
+                        block = await remote_file.read(min(size - pos, chunk_size), offset + pos)
+                        if not block:
+                            break
+                        pos += len(block)
+                        self._count_read(len(block))
+                        yield block
+        except Exception as e:
+            raise self._read_error(e, file_path, "NDSClient.iter_range")
+
+    def _count_read(self, size: int) -> None:
+        key = str(self.ID)
+        NDSClient.read_totals[key] = NDSClient.read_totals.get(key, 0) + size
+
+    @staticmethod
+    def _read_error(error: Exception, file_path: str, from_module: str) -> NDSError:
+        """将底层读取异常转换为NDSFileNotFoundError或NDSIOError"""
+        if isinstance(error, NDSError):
+            return error
+        if isinstance(error, (FileNotFoundError, asyncssh.SFTPNoSuchFile)) or (
+                isinstance(error, aioftp.StatusCodeError) and '550' in [str(code) for code in error.received_codes]):
+            return NDSFileNotFoundError(f"File not found: {file_path}", from_module, 1)
+        return NDSIOError(f'read warning: {error}', from_module, -1)
+
     async def read_file_bytes(self, file_path: str, header_offset: int = 0, size: Optional[int] = None) -> bytes:
         """读取文件内容
 
@@ -537,11 +1215,12 @@ class NDSClient:
             bytes: 读取的字节数据
 
         Raises:
+            NDSFileNotFoundError: 文件不存在
             NDSError: 文件读取错误
         """
         try:
-            await self.open(file_path)
-            await self.seek(header_offset)
-            return await self.read(size)
+            return await self.read_range(file_path, header_offset, size)
+        except NDSFileNotFoundError:
+            raise
         except Exception as e:
             raise NDSError(f"Failed to read file {file_path}: {str(e)}", level=1)
@@ -0,0 +1,165 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple, Set, Optional, Any, Awaitable, Callable, Hashable
+from NDSPool import NDSPool
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ReadRequest:
+    """区间读取请求"""
+    offset: int
+    size: int
+    future: Optional[asyncio.Future] = field(default=None, repr=False)
+    index: int = 0  # 批量读取时在请求列表中的序号
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.size
+
+
+@dataclass
+class ReadGroup:
+    """合并后的连续读取区间"""
+    start: int
+    end: int
+    requests: List[ReadRequest]
+
+    @property
+    def size(self) -> int:
+        return self.end - self.start
+
+
+def merge_ranges(requests: List[ReadRequest], max_gap: int, max_span: int) -> List[ReadGroup]:
+    """按偏移排序并合并相邻或重叠的区间
+
+    Args:
+        requests: 读取请求列表
+        max_gap: 允许合并的最大间隙(字节), 间隙数据会被读取后丢弃
+        max_span: 单次合并传输的最大字节数
+    Returns:
+        按偏移升序排列的合并区间列表
+    """
+    groups: List[ReadGroup] = []
+    for req in sorted(requests, key=lambda r: (r.offset, r.size)):
+        last = groups[-1] if groups else None
+        if last and req.offset <= last.end + max_gap and max(last.end, req.end) - last.start <= max_span:
+            last.end = max(last.end, req.end)
+            last.requests.append(req)
+        else:
+            groups.append(ReadGroup(start=req.offset, end=req.end, requests=[req]))
+    return groups
+
+
+class NDSCoalescer:
+    """同一文件的区间读取合并器
+
+    在短时间窗口内收集同一 (NDS, FilePath) 的并发读取请求, 将相邻或重叠的区间
+    合并为一次顺序传输, 再按各请求的区间拆分结果
+    """
+
+    def __init__(self, pool: NDSPool, window: float = 0.02,
+                 max_gap: int = 64 * 1024, max_span: int = 64 * 1024 * 1024):
+        self.pool = pool
+        self.window = window  # 收集窗口(秒)
+        self.max_gap = max_gap
+        self.max_span = max_span
+        self._pending: Dict[Tuple[str, str], List[ReadRequest]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self.stats = {"requests": 0, "transfers": 0, "merged": 0}
+
+    async def read(self, server_id: str, file_path: str, offset: int, size: int) -> bytes:
+        """读取指定区间, 与同一文件的并发请求合并传输"""
+        key = (server_id, file_path)
+        future = asyncio.get_running_loop().create_future()
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = self._pending[key] = []
+            task = asyncio.create_task(self._flush_later(key))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        batch.append(ReadRequest(offset=offset, size=size, future=future))
+        self.stats["requests"] += 1
+        return await future
+
+    async def _flush_later(self, key: Tuple[str, str]) -> None:
+        """等待收集窗口结束后执行合并读取"""
+        await asyncio.sleep(self.window)
+        requests = self._pending.pop(key, [])
+        if requests:
+            await self._transfer(key[0], key[1], requests)
+
+    async def _transfer(self, server_id: str, file_path: str, requests: List[ReadRequest]) -> None:
+        """按偏移顺序读取各合并区间并分发结果, 连接失效时由连接池换用新连接重试"""
+        for group in merge_ranges(requests, self.max_gap, self.max_span):
+            try:
+                data = await self.pool.run(
+                    server_id, lambda client: client.read_range(file_path, group.start, group.size), shared=True)
+            except Exception as e:
+                logger.error(f"NDS[{server_id}] Coalesced read error {file_path}: {e}")
+                self._reject(group.requests, e)
+                continue
+            self.stats["transfers"] += 1
+            self.stats["merged"] += len(group.requests) - 1
+            view = memoryview(data)
+            for req in group.requests:
+                if not req.future.done():
+                    begin = req.offset - group.start
+                    req.future.set_result(bytes(view[begin:begin + req.size]))
+            view.release()
+
+    @staticmethod
+    def _reject(requests: List[ReadRequest], error: Exception) -> None:
+        for req in requests:
+            if not req.future.done():
+                req.future.set_exception(error)
+
+    def get_status(self) -> Dict[str, int]:
+        """获取合并读取统计"""
+        return {**self.stats, "pending_files": len(self._pending)}
+
+
+class SingleFlight:
+    """相同请求的单次执行
+
+    同一键的并发调用共享一次执行, 结果或异常分发给全部调用方. 执行随发起者一同取消,
+    此时仍在等待的调用方重新发起执行
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self.stats = {"calls": 0, "shared": 0}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """执行func, 同一键已有执行进行中时等待其结果"""
+        self.stats["calls"] += 1
+        while True:
+            task = self._calls.get(key)
+            if task is None:
+                task = asyncio.ensure_future(func())
+                self._calls[key] = task
+                task.add_done_callback(lambda done: self._forget(key, done))
+                return await task
+            try:
+                result = await asyncio.shield(task)
+            except asyncio.CancelledError:
+                if not task.cancelled():
+                    raise
+                continue
+            except BaseException:
+                self.stats["shared"] += 1
+                raise
+            self.stats["shared"] += 1
+            return result
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # 避免无人等待时的未获取异常警告
+
+    def get_status(self) -> Dict[str, int]:
+        """获取单次执行统计"""
+        return {**self.stats, "in_flight": len(self._calls)}
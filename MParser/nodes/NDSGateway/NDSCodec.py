@@ -0,0 +1,86 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Any
+
+try:
+    import zstandard
+except ImportError:  # 未安装时不提供该编码
+    zstandard = None
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+logger = logging.getLogger(__name__)
+
+
+class TransferCodec:
+    """读取接口的传输压缩编码
+
+    客户端在请求中给出可接受的编码列表(Codecs), 网关按列表顺序选择本地可用的第一个;
+    子文件在包内已压缩(compress_type非0)时不再压缩. 每个数据块单独编码为一个完整的帧,
+    接收方可逐块解码, 不影响流式传输
+    """
+
+    NONE = "none"
+    ZSTD_LEVEL = 3
+    OFFLOAD_SIZE = 64 * 1024  # 超过该长度的数据块在线程中编码, 避免阻塞事件循环
+    totals: Dict[str, Dict[str, int]] = {}  # 编码 -> 原始字节数与传输字节数
+
+    def __init__(self, name: str = NONE):
+        self.name = name
+        if name == "zstd":
+            self._compress = zstandard.ZstdCompressor(level=self.ZSTD_LEVEL).compress
+        elif name == "lz4":
+            self._compress = lz4_frame.compress
+        else:
+            self._compress = None
+
+    @classmethod
+    def available(cls) -> List[str]:
+        """本地可用的编码, 按优先顺序"""
+        names = []
+        if zstandard is not None:
+            names.append("zstd")
+        if lz4_frame is not None:
+            names.append("lz4")
+        return names
+
+    @classmethod
+    def negotiate(cls, accept: Optional[List[str]], compress_type: Optional[int] = 0) -> "TransferCodec":
+        """根据客户端可接受的编码与子文件压缩方式选择传输编码"""
+        if not accept or compress_type:
+            return cls()
+        available = cls.available()
+        for name in accept:
+            if name in available:
+                return cls(name)
+        return cls()
+
+    @property
+    def enabled(self) -> bool:
+        return self._compress is not None
+
+    async def encode(self, data: bytes) -> bytes:
+        """编码一个数据块"""
+        if self._compress is None:
+            return data
+        if len(data) > self.OFFLOAD_SIZE:
+            encoded = await asyncio.to_thread(self._compress, data)
+        else:
+            encoded = self._compress(data)
+        stats = self.totals.setdefault(self.name, {"raw_bytes": 0, "wire_bytes": 0})
+        stats["raw_bytes"] += len(data)
+        stats["wire_bytes"] += len(encoded)
+        return encoded
+
+    @classmethod
+    def get_status(cls) -> Dict[str, Any]:
+        """获取各编码的压缩统计"""
+        return {
+            "available": cls.available(),
+            **{
+                name: {**stats, "ratio": round(stats["wire_bytes"] / stats["raw_bytes"], 4) if stats["raw_bytes"] else 0.0}
+                for name, stats in cls.totals.items()
+            }
+        }
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Deque, Tuple
+from NDSClient import NDSBusyError
+
+logger = logging.getLogger(__name__)
+
+
+class ByteBudget:
+    """网关全局在途字节预算
+
+    读取前按预计缓冲的字节数申请额度, 额度不足时按先到先得排队;
+    排队者超过max_waiters或等待超过max_wait秒时直接拒绝(429), 由调用方稍后重试.
+    单个请求超过总额度时, 在没有其他在途请求时放行, 避免永远无法执行
+    """
+
+    def __init__(self, max_bytes: int = 512 * 1024 * 1024, max_waiters: int = 1024,
+                 max_wait: float = 10, retry_after: int = 1):
+        self.max_bytes = max_bytes
+        self.max_waiters = max_waiters
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self._waiters: Deque[Tuple[int, asyncio.Future]] = deque()
+        self.stats = {"admitted": 0, "queued": 0, "shed": 0, "timeouts": 0}
+
+    def configure(self, max_bytes: int = None, max_waiters: int = None, max_wait: float = None) -> None:
+        """更新预算配置"""
+        if max_bytes:
+            self.max_bytes = max_bytes
+        if max_waiters:
+            self.max_waiters = max_waiters
+        if max_wait:
+            self.max_wait = max_wait
+        self._wake()
+
+    def _fits(self, size: int) -> bool:
+        return self.in_flight + size <= self.max_bytes or self.in_flight == 0
+
+    def _wake(self) -> None:
+        """按排队顺序放行额度足够的等待者"""
+        while self._waiters:
+            size, future = self._waiters[0]
+            if future.done():
+                self._waiters.popleft()
+                continue
+            if not self._fits(size):
+                break
+            self._waiters.popleft()
+            self.in_flight += size
+            future.set_result(None)
+
+    def available(self, size: int) -> bool:
+        """当前能否不排队地获得size字节额度"""
+        return not self._waiters and self._fits(max(int(size), 0))
+
+    @asynccontextmanager
+    async def acquire(self, size: int):
+        """申请size字节额度, 退出时归还
+
+        Raises:
+            NDSBusyError: 等待者已满或等待超时(status_code=429)
+        """
+        size = max(int(size), 0)
+        if not self._waiters and self._fits(size):
+            self.in_flight += size
+        else:
+            if len(self._waiters) >= self.max_waiters:
+                self.stats["shed"] += 1
+                raise NDSBusyError("Gateway read budget exhausted", "ByteBudget.acquire", 429, self.retry_after)
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append((size, future))
+            self.stats["queued"] += 1
+            try:
+                await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+            except asyncio.TimeoutError:
+                if future.done():  # 超时的同时已被放行
+                    self.in_flight -= size
+                else:
+                    future.cancel()
+                self.stats["timeouts"] += 1
+                self.stats["shed"] += 1
+                self._wake()
+                raise NDSBusyError(f"Waited {self.max_wait}s for read budget", "ByteBudget.acquire",
+                                   429, self.retry_after)
+            except BaseException:
+                if future.done() and not future.cancelled():
+                    self.in_flight -= size
+                future.cancel()
+                self._wake()
+                raise
+        self.stats["admitted"] += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= size
+            self._wake()
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取预算使用情况"""
+        return {
+            **self.stats,
+            "in_flight_bytes": self.in_flight,
+            "max_bytes": self.max_bytes,
+            "waiting": sum(1 for _, future in self._waiters if not future.done()),
+            "max_waiters": self.max_waiters
+        }
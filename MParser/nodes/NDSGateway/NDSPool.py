@@ -1,12 +1,23 @@
+import time
 import asyncio
 import logging
 from contextlib import asynccontextmanager
-from typing import Dict, Optional
-from dataclasses import dataclass
-from NDSClient import NDSClient
+from collections import deque
+from typing import Dict, Optional, List, Any, Callable, Awaitable, Deque
+from dataclasses import dataclass, field, fields
+from NDSClient import NDSClient, NDSFileNotFoundError, NDSBusyError, NDSIOError, NDSUnavailableError
 
 logger = logging.getLogger(__name__)
 
+LANE_SCAN = "scan"  # 目录扫描与ZIP目录解析
+LANE_READ = "read"  # 解析节点的文件读取
+
+CONNECTION_FIELDS = ("protocol", "host", "port", "user", "passwd")  # 变化时需更换连接的配置项
+
+BREAKER_CLOSED = "closed"  # 正常放行
+BREAKER_OPEN = "open"  # 熔断, 直接拒绝请求
+BREAKER_HALF_OPEN = "half_open"  # 熔断到期, 放行单个探测请求
+
 
 class NDSError(Exception):
     """NDS错误"""
@@ -21,98 +32,703 @@ class PoolConfig:
     port: int
     user: str
     passwd: str
-    pool_size: int = 2
+    pool_size: int = 2  # 最大连接数(max_size)
+    min_idle: int = 1  # 后台预先建立并保持的空闲连接数
+    sftp_streams: int = 8  # 每条SFTP连接同时服务的读取数
+    max_waiters: int = 64  # 等待空闲连接的最大协程数, 超出直接拒绝
+    acquire_timeout: float = 30  # 等待空闲连接的最长时间(秒)
+    keepalive_interval: float = 30  # 空闲连接的保活间隔(秒), 间隔内用过或检查过的连接直接复用
+    max_idle_time: float = 300  # 空闲超过该时间(秒)的连接被关闭, 保留min_idle个
+    max_connections: int = 0  # 连接数上限(自适应调整pool_size时不超过该值), 网关配置POOL_MAX_CONNECTIONS, 0为与pool_size相同
+    adaptive: bool = True  # 是否按吞吐量自适应调整pool_size
+    lane_reserved: Dict[str, int] = field(default_factory=dict)  # 各类请求预留的连接数, 默认不预留(小连接池预留会使读取减半)
+    lane_weights: Dict[str, int] = field(default_factory=lambda: {LANE_SCAN: 1, LANE_READ: 1})  # 排队时的权重
+
+    def __post_init__(self):
+        self.pool_size = max(int(self.pool_size), 1)
+        # 未设置连接数上限时即为pool_size, 不自动增加连接, 以免超出厂商的会话数限制
+        if self.max_connections <= 0:
+            self.max_connections = self.pool_size
+        self.pool_size = min(self.pool_size, self.max_connections)
+        self.min_idle = max(int(self.min_idle), 0)
+        self.lane_reserved = {str(lane): int(count) for lane, count in self.lane_reserved.items()}
+        self.lane_weights = {str(lane): max(int(weight), 1) for lane, weight in self.lane_weights.items()}
+
+    @property
+    def max_size(self) -> int:
+        return self.pool_size
+
+    @classmethod
+    def from_record(cls, nds: Dict[str, Any], defaults: Optional[Dict[str, Any]] = None) -> "PoolConfig":
+        """由后端NDS记录生成连接池配置
+
+        后端记录只提供连接信息; 连接数、空闲连接与份额等由网关统一配置(main.py 中的 POOL_* 环境变量)
+
+        Args:
+            nds: 后端NDS记录
+            defaults: 网关级的连接池配置(字段名 -> 值), 对所有服务器生效
+        """
+        return cls(
+            protocol=nds['Protocol'],
+            host=nds['Address'],
+            port=nds['Port'],
+            user=nds['Account'],
+            passwd=nds['Password'],
+            **(defaults or {})
+        )
 
 
 @dataclass
 class ConnectionInfo:
     """连接信息"""
     client: Optional[NDSClient]
+    counts: Optional[Dict[str, int]] = None  # 所属服务器的连接计数, 关闭时扣减
+    config: Optional["PoolConfig"] = None  # 建立连接时使用的配置, 配置更新后据此识别旧连接
+    last_used: float = field(default_factory=time.monotonic)  # 最近一次归还连接池的时间
+    last_checked: float = field(default_factory=time.monotonic)  # 最近一次确认可用的时间
+
+
+class LaneScheduler:
+    """按请求类别(lane)分配单个服务器的连接份额
+
+    - 预留: 某类别尚未用满的预留份额不会被其他类别占用, 预留总数不超过容量减一
+    - 公平排队: 多个类别同时等待时, 优先放行 使用中连接数/权重 最小的类别, 同类别内先到先得
+    """
+
+    def __init__(self, capacity: int, reserved: Optional[Dict[str, int]] = None,
+                 weights: Optional[Dict[str, int]] = None, max_waiters: int = 64):
+        self.weights = dict(weights or {})
+        self.max_waiters = max_waiters
+        self.in_use: Dict[str, int] = {}
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {}
+        self.shed = 0
+        self.queued = 0  # 需要排队的获取次数
+        self.set_capacity(capacity, reserved)
+
+    def set_capacity(self, capacity: int, reserved: Optional[Dict[str, int]] = None) -> None:
+        """设置容量与预留份额, 容量增加时立即放行等待者; 减少时已借出的份额在归还后生效"""
+        self.capacity = max(capacity, 1)
+        self.reserved = {}
+        budget = self.capacity - 1
+        for lane, count in (reserved or {}).items():
+            count = min(max(count, 0), budget)
+            if count:
+                self.reserved[lane] = count
+                budget -= count
+        self._dispatch()
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for queue in self._waiters.values() for future in queue if not future.done())
+
+    def _eligible(self, lane: str) -> bool:
+        """lane能否在不占用其他类别预留份额的前提下获得一个连接"""
+        free = self.capacity - sum(self.in_use.values())
+        if free <= 0:
+            return False
+        if self.in_use.get(lane, 0) < self.reserved.get(lane, 0):
+            return True
+        held = sum(max(count - self.in_use.get(other, 0), 0)
+                   for other, count in self.reserved.items() if other != lane)
+        return free > held
+
+    def _take(self, lane: str) -> None:
+        self.in_use[lane] = self.in_use.get(lane, 0) + 1
+
+    def try_acquire(self, lane: str) -> bool:
+        """不等待地获取份额"""
+        if self._waiters.get(lane) or not self._eligible(lane):
+            return False
+        self._take(lane)
+        return True
+
+    async def acquire(self, lane: str, timeout: float) -> None:
+        """获取份额, 等待者已满或超时时抛出NDSBusyError(503)"""
+        if self.try_acquire(lane):
+            return
+        if self.waiting >= self.max_waiters:
+            self.shed += 1
+            raise NDSBusyError("Connection queue is full", "NDSPool.get_client", 503)
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(lane, deque()).append(future)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                self.release(lane)  # 超时或取消的同时已被放行
+            else:
+                future.cancel()
+            if isinstance(e, asyncio.TimeoutError):
+                self.shed += 1
+                raise NDSBusyError(f"Waited {timeout}s for a connection", "NDSPool.get_client", 503)
+            raise
+
+    def release(self, lane: str) -> None:
+        """归还份额并按公平顺序放行等待者"""
+        self.in_use[lane] = max(self.in_use.get(lane, 0) - 1, 0)
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while True:
+            ready = []
+            for lane, queue in self._waiters.items():
+                while queue and queue[0].done():
+                    queue.popleft()
+                if queue and self._eligible(lane):
+                    ready.append(lane)
+            if not ready:
+                return
+            lane = min(ready, key=lambda item: self.in_use.get(item, 0) / self.weights.get(item, 1))
+            self._take(lane)
+            self._waiters[lane].popleft().set_result(None)
+
+    def share(self, lane: str) -> int:
+        """lane按权重应得的连接数, 不少于其预留份额且至少为1"""
+        lanes = set(self.weights) | {lane}
+        total = sum(self.weights.get(name, 1) for name in lanes)
+        return max(self.capacity * self.weights.get(lane, 1) // total, self.reserved.get(lane, 0), 1)
+
+    def waiting_in(self, lane: str) -> int:
+        """lane中正在等待的请求数"""
+        return sum(1 for future in self._waiters.get(lane, ()) if not future.done())
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "lanes": {
+                lane: {
+                    "in_use": self.in_use.get(lane, 0),
+                    "reserved": self.reserved.get(lane, 0),
+                    "waiting": self.waiting_in(lane)
+                }
+                for lane in sorted(set(self.in_use) | set(self.reserved) | set(self._waiters))
+            },
+            "waiting": self.waiting,
+            "shed": self.shed
+        }
+
+
+class CircuitBreaker:
+    """单个NDS的熔断器
+
+    记录最近 window 次连接与读取的结果, 失败率达到 failure_rate 时熔断 open_time 秒,
+    期间请求直接以NDSUnavailableError拒绝; 到期后放行一个探测请求, 成功则恢复,
+    失败则再次熔断且熔断时间加倍(不超过 max_open_time)
+    """
+
+    def __init__(self, window: int = 20, min_calls: int = 5, failure_rate: float = 0.5,
+                 open_time: float = 30, max_open_time: float = 300):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_time = open_time
+        self.max_open_time = max_open_time
+        self.state = BREAKER_CLOSED
+        self._results: Deque[bool] = deque(maxlen=window)  # True为成功
+        self._open_until = 0.0
+        self._backoff = open_time
+        self._probing = False
+        self.trips = 0  # 熔断次数
+        self.rejected = 0  # 熔断期间拒绝的请求数
+
+    def allow(self) -> bool:
+        """判断是否放行请求, 半开状态下只放行一个探测请求"""
+        if self.state == BREAKER_OPEN:
+            if time.monotonic() < self._open_until:
+                return False
+            self.state = BREAKER_HALF_OPEN
+        if self.state == BREAKER_HALF_OPEN:
+            if self._probing:
+                return False
+            self._probing = True
+        return True
+
+    def retry_after(self) -> int:
+        """距离熔断到期的秒数"""
+        return max(int(self._open_until - time.monotonic()) + 1, 1)
+
+    def record(self, success: Optional[bool], probe: bool = False) -> None:
+        """记录一次请求结果, None表示结果与NDS可用性无关(如网关繁忙); probe为半开状态放行的探测请求"""
+        if probe:
+            self._probing = False
+            if self.state != BREAKER_HALF_OPEN:
+                return
+            if success is True:
+                self._close()
+            elif success is False:
+                self._trip(self._backoff * 2)
+            return
+        if success is None or self.state != BREAKER_CLOSED:
+            return
+        self._results.append(success)
+        failures = self._results.count(False)
+        if len(self._results) >= self.min_calls and failures >= len(self._results) * self.failure_rate:
+            self._trip(self.open_time)
+
+    def _trip(self, open_time: float) -> None:
+        self._backoff = min(open_time, self.max_open_time)
+        self.state = BREAKER_OPEN
+        self._open_until = time.monotonic() + self._backoff
+        self._results.clear()
+        self.trips += 1
+
+    def _close(self) -> None:
+        self.state = BREAKER_CLOSED
+        self._backoff = self.open_time
+        self._results.clear()
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "failures": self._results.count(False),
+            "calls": len(self._results),
+            "retry_after": self.retry_after() if self.state == BREAKER_OPEN else 0,
+            "trips": self.trips,
+            "rejected": self.rejected
+        }
+
+
+@dataclass
+class SharedLease:
+    """共享连接租约: 从连接池借出一条连接, 由多个并发读取共同使用"""
+    context: Any
+    client: Optional[NDSClient] = None
+    users: int = 0
+    failed: bool = False
+    error: Optional[Exception] = None  # 使使用者失败的首个异常, 归还时交给get_client处理
+    ready: asyncio.Event = field(default_factory=asyncio.Event)
 
 
 class NDSPool:
-    """NDS连接池管理器"""
+    """NDS连接池管理器
+
+    连接健康由后台保活任务维护: 定期向空闲连接发送轻量请求并关闭失效或长期空闲的连接,
+    获取连接时不再逐次检查; 使用中出现I/O错误的连接被关闭, run() 会换用新连接透明重试.
+    添加服务器及连接减少后在后台预建连接, 使空闲连接数保持在min_idle, 请求不必等待登录.
+    每个服务器有独立的熔断器, 连接或读取持续失败时请求直接以NDSUnavailableError(502)拒绝
+    """
+
+    KEEPALIVE_TICK = 10  # 保活任务的巡检间隔(秒)
+    PREWARM_RETRY_DELAY = 60  # 预建连接失败后再次尝试的间隔(秒)
+    IO_RETRY_COUNT = 1  # I/O错误时换用新连接重试的次数
 
     def __init__(self):
         self._pools: Dict[str, asyncio.Queue[ConnectionInfo]] = {}  # server_id -> connection queue
         self._configs: Dict[str, PoolConfig] = {}  # server_id -> config
+        self._shared: Dict[str, List[SharedLease]] = {}  # server_id -> 共享连接租约
+        self._lanes: Dict[str, LaneScheduler] = {}  # server_id -> 连接份额调度
+        self._counts: Dict[str, Dict[str, int]] = {}  # server_id -> {"total": 已建立及建立中的连接数}
+        self._health: Dict[str, Dict[str, int]] = {}  # server_id -> 保活、失效与重试计数
+        self._breakers: Dict[str, CircuitBreaker] = {}  # server_id -> 熔断器
+        self._keepalive_task: Optional[asyncio.Task] = None
+        self._prewarm_tasks: Dict[str, asyncio.Task] = {}  # server_id -> 预建连接任务
+        self._prewarm_failed: Dict[str, float] = {}  # server_id -> 最近一次预建失败的时间
         self.nds_log = {}
 
     def add_server(self, server_id: str, config: PoolConfig) -> None:
         """添加服务器配置"""
         self._configs[server_id] = config
-        self._pools[server_id] = asyncio.Queue(maxsize=config.pool_size)
+        self._pools[server_id] = asyncio.Queue()  # 连接总数由_counts限制
+        self._counts[server_id] = {"total": 0}
+        self._shared[server_id] = []
+        self._lanes[server_id] = LaneScheduler(
+            config.pool_size, config.lane_reserved, config.lane_weights, config.max_waiters)
+        self._health.setdefault(server_id, {"keepalives": 0, "dead": 0, "retries": 0, "prewarmed": 0,
+                                            "login_failures": 0})
+        self._breakers[server_id] = CircuitBreaker()
         self.nds_log[server_id] = 0
+        self._prewarm_failed.pop(server_id, None)
+        self._start_keepalive()
+        self._schedule_prewarm(server_id)
+
+    def _create_client(self, server_id: str, config: PoolConfig) -> NDSClient:
+        return NDSClient(
+            protocol=config.protocol,
+            host=config.host,
+            port=config.port,
+            user=config.user,
+            passwd=config.passwd,
+            nds_id=server_id
+        )
+
+    def _can_open(self, server_id: str) -> bool:
+        return self._counts[server_id]["total"] < self._configs[server_id].pool_size
+
+    async def _open_connection(self, server_id: str, retry_count: Optional[int] = None) -> ConnectionInfo:
+        """建立新连接, 建立期间即计入连接总数, 调用前须确认_can_open"""
+        counts = self._counts[server_id]
+        config = self._configs[server_id]
+        counts["total"] += 1
+        client = self._create_client(server_id, config)
+        try:
+            await client.connect(retry_count)
+        except BaseException as e:
+            counts["total"] -= 1
+            if isinstance(e, Exception) and server_id in self._health:
+                self._health[server_id]["login_failures"] += 1
+            raise
+        return ConnectionInfo(client=client, counts=counts, config=config)
+
+    def _schedule_prewarm(self, server_id: str) -> None:
+        """空闲连接少于min_idle时启动后台预建任务, 预建失败后PREWARM_RETRY_DELAY秒内不再尝试"""
+        config = self._configs.get(server_id)
+        if config is None or self._pools[server_id].qsize() >= config.min_idle or not self._can_open(server_id):
+            return
+        if self._breakers[server_id].state != BREAKER_CLOSED:
+            return
+        task = self._prewarm_tasks.get(server_id)
+        if task is not None and not task.done():
+            return
+        failed_at = self._prewarm_failed.get(server_id)
+        if failed_at is not None and time.monotonic() - failed_at < self.PREWARM_RETRY_DELAY:
+            return
+        try:
+            self._prewarm_tasks[server_id] = asyncio.get_running_loop().create_task(self._prewarm(server_id))
+        except RuntimeError:
+            pass
+
+    async def _prewarm(self, server_id: str) -> None:
+        """建立连接并放入连接池, 直到空闲连接数达到min_idle"""
+        config = self._configs.get(server_id)
+        queue = self._pools.get(server_id)
+        while (config is not None and self._configs.get(server_id) is config
+               and queue.qsize() < config.min_idle and self._can_open(server_id)):
+            try:
+                conn = await self._open_connection(server_id)
+            except Exception as e:
+                self._prewarm_failed[server_id] = time.monotonic()
+                self._breakers[server_id].record(False)
+                logger.warning(f"NDS[{server_id}] Prewarm connection failed: {e}")
+                return
+            if self._configs.get(server_id) is not config:  # 预建期间服务器被移除或更新
+                await self._close_connection(conn)
+                return
+            try:
+                queue.put_nowait(conn)
+            except asyncio.QueueFull:
+                await self._close_connection(conn)
+                return
+            self._prewarm_failed.pop(server_id, None)
+            self._health[server_id]["prewarmed"] += 1
+
+    def _start_keepalive(self) -> None:
+        """启动保活任务(需在事件循环中调用)"""
+        if self._keepalive_task is not None and not self._keepalive_task.done():
+            return
+        try:
+            self._keepalive_task = asyncio.get_running_loop().create_task(self._keepalive_loop())
+        except RuntimeError:
+            pass
+
+    async def _keepalive_loop(self) -> None:
+        """定期巡检各连接池的空闲连接"""
+        while True:
+            await asyncio.sleep(self.KEEPALIVE_TICK)
+            for server_id in list(self._configs):
+                try:
+                    await self._keepalive_server(server_id)
+                    self._schedule_prewarm(server_id)
+                except Exception as e:
+                    logger.error(f"NDS[{server_id}] Keepalive error: {e}")
+
+    async def _keepalive_server(self, server_id: str) -> None:
+        """保活单个服务器的空闲连接: 关闭空闲超时或保活失败的连接, 其余放回连接池"""
+        queue = self._pools.get(server_id)
+        config = self._configs.get(server_id)
+        if queue is None or config is None:
+            return
+        for _ in range(queue.qsize()):
+            try:
+                conn = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            now = time.monotonic()
+            if not conn.client or (now - conn.last_used > config.max_idle_time and queue.qsize() >= config.min_idle):
+                await self._close_connection(conn)
+                continue
+            if self._counts[server_id]["total"] > config.pool_size:  # 连接数上限已调低
+                await self._close_connection(conn)
+                continue
+            if now - conn.last_checked >= config.keepalive_interval:
+                self._health[server_id]["keepalives"] += 1
+                if not await conn.client.keepalive():
+                    self._health[server_id]["dead"] += 1
+                    await self._close_connection(conn)
+                    continue
+                conn.last_checked = time.monotonic()
+            if conn.config is not self._configs.get(server_id):  # 保活期间配置已更新
+                await self._close_connection(conn)
+                continue
+            try:
+                queue.put_nowait(conn)
+            except asyncio.QueueFull:
+                await self._close_connection(conn)
+
+    async def _validate(self, server_id: str, conn: ConnectionInfo) -> bool:
+        """确认取出的空闲连接可用: 保活间隔内用过或检查过的连接不再检查, 否则发送一次保活请求"""
+        if not conn.client or not conn.client.client or conn.config is not self._configs.get(server_id):
+            return False
+        now = time.monotonic()
+        interval = self._configs[server_id].keepalive_interval
+        if now - conn.last_used < interval or now - conn.last_checked < interval:
+            return True
+        self._health[server_id]["keepalives"] += 1
+        if await conn.client.keepalive():
+            conn.last_checked = time.monotonic()
+            return True
+        self._health[server_id]["dead"] += 1
+        return False
 
     @asynccontextmanager
-    async def get_client(self, server_id: str):
-        """获取客户端连接的上下文管理器"""
+    async def get_client(self, server_id: str, wait: bool = True, lane: str = LANE_READ):
+        """获取客户端连接的上下文管理器
+
+        Args:
+            server_id: 服务器ID
+            wait: 为False时只使用当前空闲的连接, 没有空闲连接或份额时返回None
+            lane: 请求类别, 决定使用的连接份额(LANE_SCAN/LANE_READ)
+        """
         if server_id not in self._configs:
             raise NDSError(f"Server {server_id} not configured")
 
         queue = self._pools[server_id]
+        lanes = self._lanes[server_id]
+        breaker = self._breakers[server_id]
         conn = None
+        probe = False
+        if not wait:
+            if queue.empty() or breaker.state != BREAKER_CLOSED or not lanes.try_acquire(lane):
+                yield None
+                return
+        else:
+            probe = self._check_breaker(server_id)
+            try:
+                await lanes.acquire(lane, self._configs[server_id].acquire_timeout)
+            except BaseException:
+                breaker.record(None, probe)
+                raise
 
+        success = None  # 本次使用的结果, 用于熔断器统计
         try:
-            # 1. 尝试从队列获取连接
-            try:
+            if breaker.state != BREAKER_CLOSED and not probe:  # 排队期间已熔断
+                breaker.rejected += 1
+                raise NDSUnavailableError(f"NDS {server_id} is unavailable", "NDSPool.get_client",
+                                          breaker.retry_after())
+
+            # 1. 尝试从队列获取空闲连接
+            while conn is None and not queue.empty():
                 conn = queue.get_nowait()
-                if not conn.client or not await conn.client.check_connect():
+                if not await self._validate(server_id, conn):
+                    await self._close_connection(conn)
+                    conn = None
+
+            # 2. 没有空闲连接时在容量内创建新连接, 连接数已满(有连接正在预建)时等待其归还
+            while conn is None:
+                if self._can_open(server_id):
+                    # 半开状态的探测请求只尝试一次连接, 尽快得出结果
+                    retry_count = 1 if probe else None
+                    conn = await self._open_connection(server_id, retry_count)
+                    break
+                try:
+                    conn = await asyncio.wait_for(queue.get(), self._configs[server_id].acquire_timeout)
+                except asyncio.TimeoutError:
+                    raise NDSBusyError(f"NDS {server_id} has no free connection", "NDSPool.get_client", 503)
+                if not await self._validate(server_id, conn):
                     await self._close_connection(conn)
                     conn = None
-            except asyncio.QueueEmpty:
-                pass
-
-            # 2. 如果没有可用连接，创建新连接
-            if not conn:
-                if queue.qsize() < self._configs[server_id].pool_size:
-                    config = self._configs[server_id]
-                    client = NDSClient(
-                        protocol=config.protocol,
-                        host=config.host,
-                        port=config.port,
-                        user=config.user,
-                        passwd=config.passwd,
-                        nds_id=server_id
-                    )
-                    await client.connect()
-                    conn = ConnectionInfo(client=client)
-                else:
-                    # 3. 如果队列已满，等待可用连接
-                    conn = await queue.get()  # 无限等待直到有可用连接
-                    if not conn.client or not await conn.client.check_connect():
-                        await self._close_connection(conn)
-                        raise NDSError("Failed to get valid connection")
 
             yield conn.client
+            success = True
 
+        except NDSFileNotFoundError:
+            success = True
+            raise
+        except NDSBusyError:
+            raise
+        except NDSIOError:
+            # 使用中出现I/O错误, 连接可能已失效, 关闭后原样抛出以便调用方重试
+            success = False
+            if conn:
+                self._health[server_id]["dead"] += 1
+                await self._close_connection(conn)
+                self._schedule_prewarm(server_id)
+            raise
         except Exception as e:
             if conn:
                 await self._close_connection(conn)
+            else:
+                success = False  # 建立连接失败
             logger.error(f"Error in get_client: {e}")
             raise NDSError(f"Failed to get client: {e}")
 
         finally:
             if conn and conn.client:  # 只有当连接有效时才放回队列
                 try:
-                    await queue.put(conn)
+                    if self._pools.get(server_id) is not queue or conn.config is not self._configs[server_id]:
+                        raise NDSError("Server removed or updated")  # 连接属于已移除或已更新的配置
+                    if conn.counts["total"] > self._configs[server_id].pool_size:
+                        raise NDSError("Pool size reduced")
+                    await conn.client.expire_handles()
+                    conn.last_used = time.monotonic()
+                    queue.put_nowait(conn)
                 except Exception as e:
-                    logger.error(f"Error releasing connection: {e}")
+                    logger.info(f"NDS[{server_id}] Close released connection: {e}")
                     await self._close_connection(conn)
+            lanes.release(lane)
+            breaker.record(success, probe)
+
+    def _check_breaker(self, server_id: str) -> bool:
+        """熔断中时直接抛出NDSUnavailableError, 返回本次请求是否为半开状态的探测请求"""
+        breaker = self._breakers[server_id]
+        if not breaker.allow():
+            breaker.rejected += 1
+            raise NDSUnavailableError(f"NDS {server_id} is unavailable", "NDSPool.get_client",
+                                      breaker.retry_after())
+        return breaker.state == BREAKER_HALF_OPEN
+
+    def resize(self, server_id: str, size: int) -> int:
+        """调整服务器的连接数上限(不超过max_connections), 多出的连接在归还或保活巡检时关闭
+
+        Returns:
+            调整后的连接数上限
+        """
+        config = self._configs.get(server_id)
+        if config is None:
+            raise NDSError(f"Server {server_id} not configured")
+        size = min(max(int(size), 1), config.max_connections)
+        if size != config.pool_size:
+            logger.info(f"NDS[{server_id}] Pool size {config.pool_size} -> {size}")
+            config.pool_size = size
+            self._lanes[server_id].set_capacity(size, config.lane_reserved)
+        return size
+
+    def lane_share(self, server_id: str, lane: str) -> int:
+        """lane按权重应得的连接数"""
+        return self._lanes[server_id].share(lane)
+
+    def lane_waiting(self, server_id: str, lane: str) -> int:
+        """lane中正在等待连接的请求数"""
+        return self._lanes[server_id].waiting_in(lane)
+
+    def get_usage(self, server_id: str) -> Dict[str, int]:
+        """获取自适应调整所需的计数: 连接上限、排队次数、登录失败次数"""
+        return {
+            "pool_size": self._configs[server_id].pool_size,
+            "queued": self._lanes[server_id].queued,
+            "login_failures": self._health[server_id]["login_failures"]
+        }
+
+    async def run(self, server_id: str, operation: Callable[[NDSClient], Awaitable[Any]], shared: bool = False,
+                  lane: str = LANE_READ) -> Any:
+        """在连接池的连接上执行operation(client)
+
+        出现NDSIOError时该连接已被关闭, 换用新连接重试 IO_RETRY_COUNT 次
+
+        Args:
+            server_id: 服务器ID
+            operation: 接收客户端并返回协程的函数
+            shared: 是否使用可并发共享的连接(仅限不依赖读取位置的操作)
+            lane: 请求类别
+        """
+        for attempt in range(self.IO_RETRY_COUNT + 1):
+            try:
+                context = self.get_shared_client(server_id, lane) if shared else self.get_client(server_id, lane=lane)
+                async with context as client:
+                    return await operation(client)
+            except NDSIOError as e:
+                if attempt >= self.IO_RETRY_COUNT or server_id not in self._health:
+                    raise
+                self._health[server_id]["retries"] += 1
+                logger.warning(f"NDS[{server_id}] I/O error, retry on a new connection: {e}")
+
+    @asynccontextmanager
+    async def get_shared_client(self, server_id: str, lane: str = LANE_READ):
+        """获取可并发共享的客户端连接, 仅用于不依赖读取位置的操作(NDSClient.read_range)
+
+        SFTP连接可同时服务 sftp_streams 个读取, 最后一个使用者退出时归还连接池;
+        其他协议等同于get_client
+        """
+        if server_id not in self._configs:
+            raise NDSError(f"Server {server_id} not configured")
+        config = self._configs[server_id]
+        if config.protocol != "SFTP":
+            async with self.get_client(server_id, lane=lane) as client:
+                yield client
+            return
+
+        leases = self._shared[server_id]
+        lease = next((item for item in leases if not item.failed and item.users < config.sftp_streams), None)
+        if lease is None:
+            lease = SharedLease(context=self.get_client(server_id, lane=lane))
+            leases.append(lease)
+            lease.users += 1
+            try:
+                lease.client = await lease.context.__aenter__()
+            except BaseException:
+                lease.failed = True
+                lease.users -= 1
+                if lease in leases:
+                    leases.remove(lease)
+                raise
+            finally:
+                lease.ready.set()
+        else:
+            lease.users += 1
+            await lease.ready.wait()
+            if lease.client is None:
+                lease.users -= 1
+                raise NDSError("Failed to get shared client")
+
+        try:
+            yield lease.client
+        except NDSFileNotFoundError:
+            raise
+        except Exception as e:
+            lease.failed = True  # 连接可能已不可用, 不再分配给新的使用者
+            if lease.error is None:
+                lease.error = e
+            raise
+        finally:
+            lease.users -= 1
+            if lease.users == 0:
+                if lease in leases:
+                    leases.remove(lease)
+                await self._release_lease(lease)
+
+    @staticmethod
+    async def _release_lease(lease: SharedLease) -> None:
+        """归还共享连接, 失败的连接连同原始异常交给get_client关闭并计入熔断与失效统计"""
+        error = None
+        try:
+            if lease.failed:
+                error = lease.error or NDSError("Shared connection failed")
+                await lease.context.__aexit__(type(error), error, error.__traceback__)
+            else:
+                await lease.context.__aexit__(None, None, None)
+        except Exception as e:
+            if e is not error:
+                logger.warning(f"Release shared connection: {e}")
 
     @staticmethod
     async def _close_connection(conn: ConnectionInfo) -> None:
-        """关闭连接"""
+        """关闭连接并扣减所属服务器的连接数"""
         if conn and conn.client:
+            client, conn.client = conn.client, None
+            if conn.counts is not None:
+                conn.counts["total"] -= 1
             try:
-                await conn.client.close_connect()
+                await client.close_connect()
             except Exception as e:
                 logger.error(f"Error closing connection: {e}")
-            finally:
-                conn.client = None
 
     async def close(self) -> None:
         """关闭连接池"""
+        if self._keepalive_task is not None:
+            self._keepalive_task.cancel()
+            self._keepalive_task = None
+        for task in self._prewarm_tasks.values():
+            task.cancel()
+        self._prewarm_tasks.clear()
         for server_id, queue in self._pools.items():
             while not queue.empty():
                 try:
@@ -127,11 +743,58 @@ class NDSPool:
         self._configs.clear()
         logger.info("Connection pool closed")
 
+    async def update_server(self, server_id: str, config: PoolConfig) -> bool:
+        """更新服务器配置, 不中断进行中的请求
+
+        连接相关的配置项(CONNECTION_FIELDS)未变化时原地更新其余配置, 保留现有连接;
+        变化时关闭空闲连接, 使用中的连接在当前操作完成归还时关闭, 新请求使用新配置建立连接.
+        自适应调整开启时保留当前的连接数上限(不超过新的max_connections)
+
+        Returns:
+            是否更换了连接
+        """
+        current = self._configs.get(server_id)
+        if current is None:
+            self.add_server(server_id, config)
+            return True
+
+        if config.adaptive:
+            config.pool_size = min(current.pool_size, config.max_connections)
+        reconnect = any(getattr(current, name) != getattr(config, name) for name in CONNECTION_FIELDS)
+        if reconnect:
+            self._configs[server_id] = config
+            task = self._prewarm_tasks.pop(server_id, None)
+            if task is not None:
+                task.cancel()
+            for lease in self._shared[server_id]:
+                lease.failed = True  # 不再分配给新的使用者
+            queue = self._pools[server_id]
+            while not queue.empty():
+                await self._close_connection(queue.get_nowait())
+            self._breakers[server_id] = CircuitBreaker()
+            self._prewarm_failed.pop(server_id, None)
+            logger.info(f"NDS[{server_id}] Connection settings changed, draining old connections")
+        else:
+            for item in fields(PoolConfig):
+                setattr(current, item.name, getattr(config, item.name))
+            config = current
+
+        lanes = self._lanes[server_id]
+        lanes.weights = dict(config.lane_weights)
+        lanes.max_waiters = config.max_waiters
+        lanes.set_capacity(config.pool_size, config.lane_reserved)
+        self._schedule_prewarm(server_id)
+        return reconnect
+
     async def remove_server(self, server_id: str) -> None:
         """移除服务器配置"""
         if server_id not in self._configs:
             return
 
+        task = self._prewarm_tasks.pop(server_id, None)
+        if task is not None:
+            task.cancel()
+
         # 关闭所有连接
         queue = self._pools[server_id]
         while not queue.empty():
@@ -146,6 +809,10 @@ class NDSPool:
         # 移除配置
         del self._pools[server_id]
         del self._configs[server_id]
+        self._shared.pop(server_id, None)
+        self._lanes.pop(server_id, None)
+        self._counts.pop(server_id, None)
+        self._breakers.pop(server_id, None)
         del self.nds_log[server_id]
         logger.info(f"Server {server_id} removed from pool")
 
@@ -162,8 +829,17 @@ class NDSPool:
             "host": config.host,
             "port": config.port,
             "max_connections": config.pool_size,
-            "available": config.pool_size - queue.qsize(),
-            "current_connections": queue.qsize()
+            "connection_ceiling": config.max_connections,
+            "min_idle": config.min_idle,
+            "available": queue.qsize() + config.pool_size - self._counts[server_id]["total"],
+            "current_connections": self._counts[server_id]["total"],
+            "idle": queue.qsize(),
+            "in_use": self._counts[server_id]["total"] - queue.qsize(),
+            "shared_connections": len(self._shared[server_id]),
+            "shared_users": sum(lease.users for lease in self._shared[server_id]),
+            **self._lanes[server_id].get_status(),
+            **self._health[server_id],
+            "breaker": self._breakers[server_id].get_status()
         }
 
     def get_all_pool_status(self) -> Dict:
@@ -173,6 +849,10 @@ class NDSPool:
             for server_id in self._configs
         }
 
+    def get_config(self, server_id: str) -> Optional[PoolConfig]:
+        """获取服务器当前的连接池配置, 服务器不存在时返回None"""
+        return self._configs.get(server_id)
+
     def get_server_ids(self) -> list:
         """获取所有已配置的服务器ID列表"""
         return list(self._configs.keys())
@@ -0,0 +1,162 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Dict, List, Any, Optional, Awaitable, Callable, Deque, Set
+from NDSPool import NDSPool, BREAKER_CLOSED, LANE_READ
+from NDSCache import BlockCache
+from NDSLimiter import ByteBudget
+from NDSClient import NDSFileNotFoundError
+
+logger = logging.getLogger(__name__)
+
+
+class BundlePrefetcher:
+    """新发现文件包的预读
+
+    扫描程序登记新文件包后提交其路径, 后台在连接池空闲(读取无排队且有空闲连接)时
+    按顺序整包读入块缓存, 之后解析节点读取子文件时直接命中缓存. 每个服务器同时只预读一个文件包,
+    每次读取只使用不需等待即可获得的读取份额、空闲连接与读取预算, 否则暂停; 已缓存的数据块跳过
+    """
+
+    IDLE_POLL = 1  # 连接池繁忙时再次检查的间隔(秒)
+    MAX_PENDING = 10000  # 每个服务器等待预读的文件包上限
+    CACHE_SHARE = 4  # 单个文件包不超过缓存容量(有磁盘缓存时为磁盘上限, 否则为内存上限)的 1/CACHE_SHARE
+
+    def __init__(self, pool: NDSPool, cache: BlockCache, budget: ByteBudget,
+                 stat: Callable[[str, str], Awaitable[Dict[str, Any]]], window_blocks: int = 4,
+                 max_bundle_size: int = 512 * 1024 * 1024):
+        self.pool = pool
+        self.cache = cache
+        self.budget = budget  # 预读数据同样计入网关读取预算
+        self.stat = stat  # (server_id, file_path) -> 文件大小与修改时间, 与读取共用同一版本
+        self.window_blocks = window_blocks  # 单次从NDS读取的块数
+        self.max_bundle_size = max_bundle_size  # 超过该大小或bundle_limit()的文件包不预读
+        self._pending: Dict[str, Deque[str]] = {}
+        self._queued: Dict[str, Set[str]] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self.stats = {"queued": 0, "completed": 0, "skipped": 0, "failed": 0, "bytes": 0}
+
+    def submit(self, server_id: str, file_paths: List[str]) -> int:
+        """提交待预读的文件包, 返回新加入队列的数量"""
+        if not self.cache.enabled or server_id not in self.pool.get_server_ids():
+            return 0
+        pending = self._pending.setdefault(server_id, deque())
+        queued = self._queued.setdefault(server_id, set())
+        accepted = 0
+        for file_path in file_paths:
+            if file_path in queued or len(pending) >= self.MAX_PENDING:
+                continue
+            pending.append(file_path)
+            queued.add(file_path)
+            accepted += 1
+        self.stats["queued"] += accepted
+        worker = self._workers.get(server_id)
+        if pending and (worker is None or worker.done()):
+            self._workers[server_id] = asyncio.get_running_loop().create_task(self._run(server_id))
+        return accepted
+
+    def bundle_limit(self) -> int:
+        """可预读的文件包大小上限, 避免一个文件包挤出缓存中的其他数据, 缓存关闭时为0"""
+        if not self.cache.enabled:
+            return 0
+        if self.cache.disk_dir and self.cache.disk_max_bytes > 0:
+            capacity = self.cache.disk_max_bytes
+        else:
+            capacity = self.cache.max_bytes
+        return min(self.max_bundle_size, capacity // self.CACHE_SHARE)
+
+    def _idle(self, server_id: str) -> Optional[bool]:
+        """连接池是否空闲, 服务器已移除时返回None"""
+        try:
+            status = self.pool.get_pool_status(server_id)
+        except Exception:
+            return None
+        return (self.pool.lane_waiting(server_id, LANE_READ) == 0 and status["idle"] > 0
+                and status["breaker"]["state"] == BREAKER_CLOSED)
+
+    async def _wait_idle(self, server_id: str) -> bool:
+        while True:
+            idle = self._idle(server_id)
+            if idle is None:
+                return False
+            if idle:
+                return True
+            await asyncio.sleep(self.IDLE_POLL)
+
+    async def _run(self, server_id: str) -> None:
+        pending = self._pending.get(server_id)
+        queued = self._queued.get(server_id)
+        while pending:
+            file_path = pending[0]
+            try:
+                if not await self._wait_idle(server_id):
+                    break
+                await self._prefetch(server_id, file_path)
+            except NDSFileNotFoundError:
+                self.stats["skipped"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.warning(f"NDS[{server_id}] Prefetch {file_path} error: {e}")
+            pending.popleft()
+            queued.discard(file_path)
+        self._pending.pop(server_id, None)
+        self._queued.pop(server_id, None)
+
+    async def _prefetch(self, server_id: str, file_path: str) -> None:
+        """按顺序读取整个文件包, 缺失的连续数据块每次最多读取window_blocks块"""
+        if not self.cache.enabled:
+            self.stats["skipped"] += 1
+            return
+        stat_info = await self.stat(server_id, file_path)
+        file_size = stat_info['size']
+        if file_size > self.bundle_limit():
+            self.stats["skipped"] += 1
+            return
+        block_size = self.cache.block_size
+        keys = [self.cache.make_key(server_id, file_path, stat_info['modify'], block)
+                for block in range((file_size + block_size - 1) // block_size)]
+        block = 0
+        while block < len(keys):
+            if self.cache.contains(keys[block]):
+                block += 1
+                continue
+            end = block + 1
+            while end < len(keys) and end - block < self.window_blocks and not self.cache.contains(keys[end]):
+                end += 1
+            begin = block * block_size
+            size = min(end * block_size, file_size) - begin
+            data = await self._read_idle(server_id, file_path, begin, size)
+            if data is None:  # 连接、份额或预算需要等待, 让给其他读取
+                await asyncio.sleep(self.IDLE_POLL)
+                if not await self._wait_idle(server_id):
+                    return
+                continue
+            if len(data) != size:  # 文件已变化
+                self.stats["skipped"] += 1
+                return
+            for index in range(block, end):
+                await self.cache.put(keys[index], data[(index - block) * block_size:(index - block + 1) * block_size])
+            self.stats["bytes"] += size
+            block = end
+        self.stats["completed"] += 1
+
+    async def _read_idle(self, server_id: str, file_path: str, offset: int, size: int) -> Optional[bytes]:
+        """只使用空闲的连接与读取份额读取, 需要等待时返回None"""
+        if not self.budget.available(size) or self.pool.lane_waiting(server_id, LANE_READ):
+            return None
+        async with self.budget.acquire(size), self.pool.get_client(server_id, wait=False, lane=LANE_READ) as client:
+            if client is None:
+                return None
+            return await client.read_range(file_path, offset, size)
+
+    async def stop(self) -> None:
+        """停止全部预读任务"""
+        for worker in self._workers.values():
+            worker.cancel()
+        self._workers.clear()
+        self._pending.clear()
+        self._queued.clear()
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取预读统计"""
+        return {**self.stats, "bundle_limit": self.bundle_limit(), "pending": {server_id: len(items) for server_id, items in self._pending.items()}}
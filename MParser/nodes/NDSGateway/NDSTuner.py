@@ -0,0 +1,132 @@
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Dict, Any, Optional
+from NDSPool import NDSPool
+from NDSClient import NDSClient
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TuneState:
+    """单个服务器的调整状态"""
+    read_bytes: int = 0  # 上一周期结束时的累计读取字节数
+    queued: int = 0  # 上一周期结束时的累计排队次数
+    login_failures: int = 0  # 上一周期结束时的累计登录失败次数
+    rate: float = 0.0  # 上一周期的吞吐量(字节/秒)
+    last_size: int = 0  # 上一周期的连接数上限
+    grown: bool = False  # 上一周期是否增加了连接数
+    hold: int = 0  # 剩余的保持周期数, 期间不再增加连接数
+    action: str = ""  # 最近一次调整动作
+
+
+class PoolTuner:
+    """按观测吞吐量自适应调整各服务器的连接数上限
+
+    每个周期比较吞吐量: 连接池饱和(有请求排队)时增加一个连接, 增加后吞吐量提升
+    不足 MIN_GAIN 则回退并保持若干周期; 出现登录失败时减半, 吞吐量骤降时减一.
+    连接数上限不超过网关配置的 max_connections(POOL_MAX_CONNECTIONS), 未设置时为初始pool_size(只会减少, 不会增加)
+    """
+
+    INTERVAL = 30  # 调整周期(秒)
+    MIN_GAIN = 0.1  # 增加连接后吞吐量的最小提升比例
+    COLLAPSE_RATIO = 0.5  # 吞吐量低于上一周期该比例视为骤降
+    HOLD_TICKS = 10  # 回退后保持的周期数
+
+    def __init__(self, pool: NDSPool):
+        self.pool = pool
+        self._states: Dict[str, TuneState] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._last_tick = time.monotonic()
+
+    def start(self) -> None:
+        """启动后台调整任务"""
+        if self._task is None or self._task.done():
+            self._last_tick = time.monotonic()
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self) -> None:
+        """停止后台调整任务"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.INTERVAL)
+            try:
+                self.tick()
+            except Exception as e:
+                logger.error(f"Pool tuner error: {e}")
+
+    def tick(self) -> None:
+        """执行一次调整"""
+        now = time.monotonic()
+        elapsed = max(now - self._last_tick, 1e-3)
+        self._last_tick = now
+        server_ids = self.pool.get_server_ids()
+        for server_id in server_ids:
+            config = self.pool.get_config(server_id)
+            if config is None or not config.adaptive:
+                continue
+            usage = self.pool.get_usage(server_id)
+            read_bytes = NDSClient.read_totals.get(server_id, 0)
+            state = self._states.get(server_id)
+            if state is None:
+                self._states[server_id] = TuneState(read_bytes=read_bytes, queued=usage["queued"],
+                                                    login_failures=usage["login_failures"],
+                                                    last_size=usage["pool_size"])
+                continue
+            rate = (read_bytes - state.read_bytes) / elapsed
+            queued = usage["queued"] - state.queued
+            failures = usage["login_failures"] - state.login_failures
+            size = self.decide(state, usage["pool_size"], config.max_connections, rate, queued, failures)
+            if size != usage["pool_size"]:
+                size = self.pool.resize(server_id, size)
+            state.read_bytes = read_bytes
+            state.queued = usage["queued"]
+            state.login_failures = usage["login_failures"]
+            state.rate = rate
+            state.last_size = size
+        for server_id in [key for key in self._states if key not in server_ids]:
+            del self._states[server_id]
+
+    def decide(self, state: TuneState, size: int, ceiling: int, rate: float, queued: int, failures: int) -> int:
+        """根据本周期的吞吐量、排队次数和登录失败次数计算新的连接数上限"""
+        grown, state.grown = state.grown, False
+        if failures:
+            state.hold = self.HOLD_TICKS
+            state.action = "login_failure"
+            return max(size // 2, 1)
+        if state.rate and rate < state.rate * self.COLLAPSE_RATIO and queued:
+            state.hold = self.HOLD_TICKS
+            state.action = "collapse"
+            return max(size - 1, 1)
+        if grown and rate < state.rate * (1 + self.MIN_GAIN):
+            state.hold = self.HOLD_TICKS
+            state.action = "no_gain"
+            return max(size - 1, 1)
+        if state.hold:
+            state.hold -= 1
+            state.action = "hold"
+            return size
+        if queued and size < ceiling:
+            state.grown = True
+            state.action = "grow"
+            return size + 1
+        state.action = "steady"
+        return size
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取各服务器的调整状态"""
+        return {
+            server_id: {
+                "pool_size": state.last_size,
+                "rate": round(state.rate),
+                "hold": state.hold,
+                "action": state.action
+            }
+            for server_id, state in self._states.items()
+        }
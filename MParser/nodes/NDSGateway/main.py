@@ -4,6 +4,7 @@ from fastapi import FastAPI
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 import os
+import json
 from NDSApi import router as nds_router, nds_api
 from fastapi.middleware.cors import CORSMiddleware
 import logging
@@ -31,6 +32,21 @@ SERVICE_NAME = os.getenv('SERVICE_NAME')
 SERVICE_HOST = os.getenv('SERVICE_HOST')
 SERVICE_PORT = int(os.getenv('SERVICE_PORT', 10001))
 NODE_TYPE = os.getenv('NODE_TYPE', 'NDSGateway')
+ZIP_CACHE_DIR = os.getenv('ZIP_CACHE_DIR')  # ZIP目录缓存的磁盘目录, 为空则仅使用内存
+ZIP_CACHE_SIZE = int(os.getenv('ZIP_CACHE_SIZE', 64 * 1024 * 1024))  # ZIP目录内存缓存上限(字节)
+ZIP_CACHE_DISK_SIZE = int(os.getenv('ZIP_CACHE_DISK_SIZE', 1024 * 1024 * 1024))  # ZIP目录磁盘缓存上限(字节)
+READ_BUDGET_SIZE = int(os.getenv('READ_BUDGET_SIZE', 512 * 1024 * 1024))  # 所有读取在网关内缓冲的字节上限
+READ_QUEUE_TIMEOUT = float(os.getenv('READ_QUEUE_TIMEOUT', 10))  # 读取等待预算的最长时间(秒), 超时返回429
+BLOCK_CACHE_SIZE = int(os.getenv('BLOCK_CACHE_SIZE', 0))  # 数据块内存缓存上限(字节), 默认0为关闭
+BLOCK_CACHE_DIR = os.getenv('BLOCK_CACHE_DIR')  # 数据块缓存的磁盘目录, 为空则仅使用内存(设置后即启用磁盘缓存)
+BLOCK_CACHE_DISK_SIZE = int(os.getenv('BLOCK_CACHE_DISK_SIZE', 8 * 1024 * 1024 * 1024))  # 数据块磁盘缓存上限(字节)
+# 以下连接池配置对所有NDS生效(后端NDS记录只提供连接信息)
+POOL_SIZE = int(os.getenv('POOL_SIZE', 2))  # 每个NDS的初始连接数上限
+POOL_MAX_CONNECTIONS = int(os.getenv('POOL_MAX_CONNECTIONS', 0))  # 每个NDS自适应调整时的连接数上限, 0为不超过初始连接数
+POOL_MIN_IDLE = int(os.getenv('POOL_MIN_IDLE', 1))  # 每个NDS预先建立并保持的空闲连接数
+POOL_ADAPTIVE = os.getenv('POOL_ADAPTIVE', '1') == '1'  # 是否按吞吐量自适应调整连接数
+POOL_LANE_RESERVED = json.loads(os.getenv('POOL_LANE_RESERVED', '{}'))  # 各类请求预留的连接数, 如 {"read": 1}
+POOL_LANE_WEIGHTS = json.loads(os.getenv('POOL_LANE_WEIGHTS', '{"scan": 1, "read": 1}'))  # 各类请求排队时的权重
 
 
 # # 创建socket服务器实例
@@ -78,7 +94,15 @@ async def lifespan(_: FastAPI):
     """应用生命周期管理"""
     print("等待后端启动")
     await asyncio.sleep(2)  # 等待后端启动完成
-    await nds_api.init_api(BACKEND_URL)
+    await nds_api.init_api(BACKEND_URL, zip_cache_dir=ZIP_CACHE_DIR, zip_cache_size=ZIP_CACHE_SIZE,
+                           zip_cache_disk_size=ZIP_CACHE_DISK_SIZE,
+                           read_budget_size=READ_BUDGET_SIZE, read_queue_timeout=READ_QUEUE_TIMEOUT,
+                           block_cache_size=BLOCK_CACHE_SIZE, block_cache_dir=BLOCK_CACHE_DIR,
+                           block_cache_disk_size=BLOCK_CACHE_DISK_SIZE, pool_defaults={
+                               "pool_size": POOL_SIZE, "max_connections": POOL_MAX_CONNECTIONS,
+                               "min_idle": POOL_MIN_IDLE, "adaptive": POOL_ADAPTIVE,
+                               "lane_reserved": POOL_LANE_RESERVED, "lane_weights": POOL_LANE_WEIGHTS
+                           })
     await register_gateway()
     # await socket_server.start()  # 启动socket服务器
     yield
@@ -0,0 +1,57 @@
+import asyncio
+import pytest
+
+pytest.importorskip("aioftp")
+pytest.importorskip("asyncssh")
+
+from NDSClient import NDSClient
+
+
+class FakeFTP:
+    """模拟FTP客户端: 根目录下有两个子目录, 列举子目录时一直阻塞"""
+
+    def __init__(self):
+        self.blocked = asyncio.Event()
+
+    async def list(self, dir_path, recursive=False):
+        if dir_path == "/data":
+            for name in ("a", "b"):
+                yield f"/data/{name}", {"type": "dir", "modify": "20240101000000"}
+            yield "/data/root.zip", {"type": "file", "modify": "20240101000000"}
+            return
+        self.blocked.set()
+        await asyncio.Event().wait()
+        yield f"{dir_path}/never.zip", {"type": "file"}
+
+
+def make_client() -> NDSClient:
+    client = NDSClient("FTP", "127.0.0.1", 21, "user", "passwd", nds_id="1")
+    client.client = FakeFTP()
+    return client
+
+
+def test_walk_cancel_closes_interrupted_ftp_clients():
+    async def run():
+        main, peer = make_client(), make_client()
+        fakes = [main.client, peer.client]
+        walker = main.walk("/data", concurrency=2, peers=[peer])
+        dir_path, files = await walker.__anext__()
+        assert (dir_path, files) == ("/data", ["/data/root.zip"])
+        await asyncio.wait_for(asyncio.gather(*(fake.blocked.wait() for fake in fakes)), 1)
+        await walker.aclose()
+        # 两条连接都停在子目录列举中, 取消后必须断开, 不能带着未读完的应答回到连接池
+        assert main.client is None and peer.client is None
+        assert main.scan_stats["finished"] is False
+
+    asyncio.run(run())
+
+
+def test_walk_cancel_keeps_idle_ftp_clients():
+    async def run():
+        main, peer = make_client(), make_client()
+        walker = main.walk("/data", concurrency=2, peers=[peer])
+        await walker.__anext__()
+        await walker.aclose()  # 子目录尚未开始列举
+        assert main.client is not None and peer.client is not None
+
+    asyncio.run(run())
@@ -1,6 +1,7 @@
+import json
 import httpx
 import logging
-from typing import Optional, Dict, Any, Union
+from typing import Optional, Dict, Any, Union, AsyncIterator
 from dataclasses import dataclass
 
 logger = logging.getLogger(__name__)
@@ -57,6 +58,17 @@ class HttpClient:
         else:
             return response.text
 
+    async def stream_json(self, method: str, endpoint: str, **kwargs) -> AsyncIterator[Any]:
+        """发送HTTP请求并逐行解析NDJSON响应"""
+        url = f"{self.base_url}/{endpoint.lstrip('/')}"
+        await self.ensure_client()
+
+        async with self._client.stream(method, url, **kwargs) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line.strip():
+                    yield json.loads(line)
+
     async def get(self, endpoint: str, **kwargs) -> Union[Dict[str, Any], bytes, str]:
         """发送GET请求"""
         return await self.request('GET', endpoint, **kwargs)
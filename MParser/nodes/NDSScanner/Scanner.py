@@ -1,11 +1,10 @@
 import asyncio
 import logging
 from datetime import datetime
-from typing import Dict, List, Optional, Any, Union
+from typing import Dict, List, Optional, Any, Union, AsyncIterator, Set, Tuple
 from dataclasses import dataclass
 from HttpClient import HttpClient
 import re
-from itertools import chain
 
 logger = logging.getLogger(__name__)
 
@@ -105,31 +104,57 @@ class NDSScanner:
         每个文件包含path和type信息。
         """
         try:
-            # 扫描MRO文件
-            mro_files = await self._scan_files(nds_config['ID'], nds_config['MRO_Path'], nds_config['MRO_Filter'],
-                                               "MRO")
-            # 扫描MDT文件
-            mdt_files = await self._scan_files(nds_config['ID'], nds_config['MDT_Path'], nds_config['MDT_Filter'],
-                                               "MDT")
-
-            return list(chain(mro_files, mdt_files))
+            files = []
+            async for batch in self.iter_scan_nds(nds_config):
+                files.extend(batch)
+            return files
 
         except Exception as e:
             logger.error(f"Scan error: {str(e)}")
             return []
 
-    async def _scan_files(self, nds_id: int, path: str, pattern: str, data_type: str) -> List[Dict]:
-        """扫描指定类型的文件"""
-        response = await self.gateway_client.post(
-            "nds/scan",
-            json={
-                "nds_id": nds_id,
-                "scan_path": path,
-                "filter_pattern": pattern,
-                "data_type": data_type
-            }
-        )
-        return [{"path": f, "type": data_type} for f in (response if isinstance(response, list) else [])]
+    async def iter_scan_nds(self, nds_config: Dict,
+                            windows: Optional[List[Tuple[datetime, datetime]]] = None) -> AsyncIterator[List[Dict]]:
+        """流式扫描单个NDS的MRO和MDT文件, 网关每列举完一个目录即返回一批文件
+
+        Args:
+            nds_config: NDS配置
+            windows: 任务时间范围, 提供时由网关剪枝时间范围外的目录和文件
+        """
+        for data_type in ("MRO", "MDT"):
+            async for batch in self._iter_scan_files(
+                    nds_config['ID'], nds_config[f'{data_type}_Path'], nds_config[f'{data_type}_Filter'], data_type,
+                    windows):
+                yield batch
+
+    async def _iter_scan_files(self, nds_id: int, path: str, pattern: str, data_type: str,
+                               windows: Optional[List[Tuple[datetime, datetime]]] = None) -> AsyncIterator[List[Dict]]:
+        """流式扫描指定类型的文件
+
+        Raises:
+            Exception: 网关返回错误或扫描未完整结束
+        """
+        request = {
+            "nds_id": nds_id,
+            "scan_path": path,
+            "filter_pattern": pattern,
+            "data_type": data_type
+        }
+        if windows:
+            request["time_windows"] = [
+                [start.strftime('%Y-%m-%d %H:%M:%S'), end.strftime('%Y-%m-%d %H:%M:%S')] for start, end in windows
+            ]
+            request["time_pattern"] = self._time_pattern.pattern
+        completed = False
+        async for item in self.gateway_client.stream_json("POST", "nds/scan-stream", json=request):
+            if 'files' in item:
+                yield [{"path": f, "type": data_type} for f in item['files']]
+            elif item.get('end_of_scan'):
+                completed = True
+            elif 'code' in item:
+                raise Exception(f"NDS[{nds_id}] {data_type} scan error: {item.get('message')}")
+        if not completed:
+            raise Exception(f"NDS[{nds_id}] {data_type} scan stream interrupted")
 
     async def parse_zip_info(self, nds_id: int, files: List[Dict]) -> List[Dict]:
         """解析ZIP文件信息
@@ -208,6 +233,51 @@ class NDSScanner:
             logger.error(f"Fetch configs error: {str(e)}")
             return []
 
+    async def fetch_file_context(self, nds_id: int) -> Optional[Tuple[Set[str], List[Tuple[datetime, datetime]]]]:
+        """获取数据库中已有的文件列表和任务时间范围
+
+        Returns:
+            (已有文件路径集合, [(开始时间, 结束时间)]), 获取失败返回None
+        """
+        result = await self.backend_client.get(f"ndsfile/files?nds_id={nds_id}")
+        if not isinstance(result, dict) or 'data' not in result or not result['data']:
+            return None
+        windows = []
+        for task_time in result['data'].get('times', []):
+            try:
+                windows.append((
+                    datetime.strptime(task_time['StartTime'], '%Y-%m-%d %H:%M:%S'),
+                    datetime.strptime(task_time['EndTime'], '%Y-%m-%d %H:%M:%S')
+                ))
+            except ValueError as e:
+                logger.error(f"Error parsing time: {e}")
+        return set(result['data'].get('files', [])), windows
+
+    def _in_windows(self, path: str, windows: List[Tuple[datetime, datetime]]) -> bool:
+        """文件名时间是否落在任一任务时间范围内"""
+        file_time_str = self._extract_time_from_name(path)
+        if not file_time_str:
+            return False
+        file_time = datetime.strptime(file_time_str, '%Y-%m-%d %H:%M:%S')
+        return any(start_time <= file_time <= end_time for start_time, end_time in windows)
+
+    def match_new_files(self, files: List[Dict], existing_files: Set[str],
+                        windows: List[Tuple[datetime, datetime]]) -> List[Dict]:
+        """筛选数据库中没有且文件时间落在任务时间范围内的文件"""
+        return [f for f in files if f['path'] not in existing_files and self._in_windows(f['path'], windows)]
+
+    async def remove_missing_files(self, nds_id: int, existing_files: Set[str], current_paths: Set[str]) -> None:
+        """删除数据库中有、NDS上已不存在的文件"""
+        # 使用海象运算符(:=),计算数据库中有，NDS上没有的文件进行删除
+        if files_to_delete := list(existing_files - current_paths):
+            try:
+                await self.backend_client.post(
+                    "ndsfile/remove",
+                    json={"nds_id": nds_id, "files": files_to_delete}
+                )
+            except Exception as e:
+                logger.error(f"Failed to delete files: {e}")
+
     async def diff_files(self, nds_id: int, files: List[Dict]) -> List[Dict]:
         """获取新增文件信息列表
         
@@ -227,57 +297,41 @@ class NDSScanner:
             files = list(unique_files.values())
 
             # 2. 获取数据库文件列表和任务时间映射
-            result = await self.backend_client.get(f"ndsfile/files?nds_id={nds_id}")
-            if not isinstance(result, dict) or 'data' not in result or not result['data']:
+            context = await self.fetch_file_context(nds_id)
+            if context is None:
                 return []
+            existing_files, windows = context
 
             # 3. 处理文件删除
-            existing_files = set(result['data'].get('files', []))
-            current_paths = {f['path'] for f in files}
-            # 使用海象运算符(:=),计算数据库中有，NDS上没有的文件进行删除
-            if files_to_delete := list(existing_files - current_paths):  
-                try:
-                    await self.backend_client.post(
-                        "ndsfile/remove",
-                        json={"nds_id": nds_id, "files": files_to_delete}
-                    )
-                except Exception as e:
-                    logger.error(f"Failed to delete files: {e}")
-            
+            await self.remove_missing_files(nds_id, existing_files, {f['path'] for f in files})
+
             # 4. 任务时间范围过滤
-            task_times = result['data'].get('times', [])
-            if not task_times:
+            if not windows:
                 return []  # 没有任务, 无需继续
             # 5. 筛选新文件并匹配时间范围
-            new_files = [f for f in files if f['path'] not in existing_files]  # 提取服务器中没有的文件清单
-            res_files = []
-            for new_file in new_files:
-                file_time_str = self._extract_time_from_name(new_file['path'])
-                if not file_time_str:
-                    continue
-                    
-                file_time = datetime.strptime(file_time_str, '%Y-%m-%d %H:%M:%S')
-                for task_time in task_times:
-                    try:
-                        start_time = datetime.strptime(task_time['StartTime'], '%Y-%m-%d %H:%M:%S')
-                        end_time = datetime.strptime(task_time['EndTime'], '%Y-%m-%d %H:%M:%S')
-                        
-                        
-                        if start_time <= file_time <= end_time:
-                            res_files.append(new_file)
-                            break
-                    except ValueError as e:
-                        logger.error(f"Error parsing time: {e}")
-                        continue
-                    
-                    
-            return res_files
+            return self.match_new_files(files, existing_files, windows)
         except Exception as e:
             logger.error(f"Diff files error: {str(e)}")
             return []
 
-    async def submit_file_infos(self, file_infos: List[Dict]) -> None:
-        """提交文件信息到后端"""
+    async def _process_new_files(self, nds_id: int, queue: asyncio.Queue) -> None:
+        """消费新文件批次: 解析ZIP信息并提交到后端, 收到None时结束"""
+        while True:
+            batch = await queue.get()
+            if batch is None:
+                break
+            try:
+                zip_infos = await self.parse_zip_info(nds_id, batch)
+                if zip_infos:
+                    # 最后提交文件信息, 已登记的文件包交由网关预读
+                    submitted = await self.submit_file_infos(zip_infos)
+                    await self.prefetch_files(nds_id, submitted)
+            except Exception as e:
+                logger.error(f"Failed to process batch: {str(e)}")
+
+    async def submit_file_infos(self, file_infos: List[Dict]) -> List[str]:
+        """提交文件信息到后端, 返回提交成功的文件路径"""
+        submitted = []
         try:
             # 按FilePath分组
             file_groups = {}
@@ -293,12 +347,23 @@ class NDSScanner:
                         "ndsfile/batch",
                         json={"files": group_infos}
                     )
+                    submitted.append(file_path)
                 except Exception as e:
                     logger.error(f"Failed to submit file {file_path}: {str(e)}")
                     continue  # 继续下一轮
 
         except Exception as e:
             logger.error(f"Submit file infos error: {str(e)}")
+        return submitted
+
+    async def prefetch_files(self, nds_id: int, file_paths: List[str]) -> None:
+        """通知网关预读新登记的文件包, 失败不影响扫描"""
+        if not file_paths:
+            return
+        try:
+            await self.gateway_client.post("nds/prefetch", json={"nds_id": nds_id, "file_paths": file_paths})
+        except Exception as e:
+            logger.warning(f"Prefetch request error: {str(e)}")
 
     async def has_pending_tasks(self, nds_id: int) -> bool:
         """检查NDS是否有待处理的任务"""
@@ -326,28 +391,42 @@ class NDSScanner:
                 status.is_scanning = True
                 start_time = datetime.now()
 
-                # 执行扫描
-                files = await self.scan_nds(nds_config)
-                if not files:
+                context = await self.fetch_file_context(nds_id)
+                if context is None:
                     continue
-                new_files = await self.diff_files(nds_id, files)
+                existing_files, windows = context
+
+                # 流式扫描, 新文件在扫描过程中即交由后台任务解析ZIP信息并提交
+                # 每批2个文件，避免长时间等待
+                queue: asyncio.Queue = asyncio.Queue()
+                consumer = asyncio.create_task(self._process_new_files(nds_id, queue))
+                current_paths: Set[str] = set()
+                new_files_count = 0
+                try:
+                    async for files in self.iter_scan_nds(nds_config, windows):
+                        files = [f for f in files if f['path'] not in current_paths]
+                        current_paths.update(f['path'] for f in files)
+                        if not windows:
+                            continue  # 没有任务, 只需记录文件用于删除比对
+                        new_files = self.match_new_files(files, existing_files, windows)
+                        for i in range(0, len(new_files), 2):
+                            queue.put_nowait(new_files[i:i + 2])
+                        new_files_count += len(new_files)
+                finally:
+                    queue.put_nowait(None)
+                    await consumer
+
+                # 扫描完整结束后再处理删除, 避免扫描中断时误删
+                # 网关按任务时间范围剪枝时, 只有时间范围内的已有文件可以据此判断是否已删除
+                if windows:
+                    existing_files = {f for f in existing_files if self._in_windows(f, windows)}
+                if current_paths:
+                    await self.remove_missing_files(nds_id, existing_files, current_paths)
+
                 # 更新状态
                 status.last_scan_time = start_time
                 status.scan_duration = (datetime.now() - start_time).total_seconds()
-                status.new_files_count = len(new_files)
-
-                # 如果有新文件，处理它们
-                if new_files:
-                    # 处理新文件, 每次扫描2个文件，避免长时间等待
-                    batches = [new_files[i:i + 2] for i in range(0, len(new_files), 2)]
-                    for batch in batches:
-                        try:
-                            zip_infos = await self.parse_zip_info(nds_id, batch)
-                            if zip_infos:
-                                # 最后提交文件信息
-                                await self.submit_file_infos(zip_infos)
-                        except Exception as e:
-                            logger.error(f"Failed to process batch: {str(e)}")
+                status.new_files_count = new_files_count
 
                 # 计算下次扫描时间
                 self.interval = max(self.min_interval, self.scan_interval - status.scan_duration)
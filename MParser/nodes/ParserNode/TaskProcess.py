@@ -13,6 +13,15 @@ from HttpClient import HttpClient
 from Parser import mro, mdt
 from config import BACKEND_URL, NDS_GATEWAY_URL, CK_HOST, CK_PORT, CK_USER, CK_PASSWD, CK_DB
 
+try:
+    import zstandard
+except ImportError:  # 未安装时不向网关申请该编码
+    zstandard = None
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
 
 
 
@@ -198,6 +207,61 @@ async def update_status(backend_client: HttpClient, file_hash: str, value: int):
         pass
 
 
+GATEWAY_RETRY_COUNT = 3  # 网关繁忙(429/503)时的重试次数
+
+
+def transfer_codecs() -> List[str]:
+    """可接受的传输编码, 按优先顺序"""
+    return [name for name, module in (("zstd", zstandard), ("lz4", lz4_frame)) if module is not None]
+
+
+def transfer_decoder(codec: str):
+    """返回网关选定编码的数据块解码函数, 未编码时返回None"""
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress
+    if codec == "lz4":
+        return lz4_frame.decompress
+    return None
+
+
+async def read_task_file(task_data: Dict[str, Any]) -> bytearray:
+    """通过网关WebSocket读取任务文件, 网关繁忙时按其给出的retry_after等待后重试"""
+    for attempt in range(GATEWAY_RETRY_COUNT + 1):
+        ws_url = f"ws://{NDS_GATEWAY_URL.replace('http://', '')}/nds/ws/read/{uuid.uuid4()}"
+        busy = None
+        async with websockets.connect(ws_url, max_size=2 ** 30) as websocket:
+            await websocket.send(json.dumps({
+                "NDSID": task_data['NDSID'],
+                "FilePath": task_data['FilePath'],
+                "HeaderOffset": task_data.get('HeaderOffset', 0),
+                "CompressSize": task_data.get('CompressSize'),
+                "CompressType": task_data.get('CompressType'),
+                "Codecs": transfer_codecs()
+            }))
+
+            file_data = bytearray()
+            decode = None
+            while True:
+                data = await websocket.recv()
+                if isinstance(data, str):
+                    json_data = json.loads(data)
+                    if json_data.get("end_of_file"):
+                        break
+                    if "codec" in json_data:
+                        decode = transfer_decoder(json_data["codec"])
+                        continue
+                    if json_data.get("code") in (429, 503) and attempt < GATEWAY_RETRY_COUNT:
+                        busy = json_data
+                        break
+                    if "code" in json_data:
+                        raise Exception(json.dumps(json_data))
+                else:
+                    file_data.extend(decode(data) if decode else data)
+        if busy is None:
+            return file_data
+        await asyncio.sleep(busy.get("retry_after", 1))
+
+
 # noinspection HttpUrlsUsage,PyBroadException,SqlDialectInspection
 async def parse_task(task_data: Dict[str, Any], backend_client: HttpClient, clickhouse: CKClient):
     """处理单个任务的协程"""
@@ -223,26 +287,7 @@ async def parse_task(task_data: Dict[str, Any], backend_client: HttpClient, clic
         file_suffix, table_name, parser_func = config
 
         # 获取并处理文件
-        ws_url = f"ws://{NDS_GATEWAY_URL.replace('http://', '')}/nds/ws/read/{uuid.uuid4()}"
-        async with websockets.connect(ws_url, max_size=2 ** 30) as websocket:
-            await websocket.send(json.dumps({
-                "NDSID": task_data['NDSID'],
-                "FilePath": task_data['FilePath'],
-                "HeaderOffset": task_data.get('HeaderOffset', 0),
-                "CompressSize": task_data.get('CompressSize')
-            }))
-
-            file_data = bytearray()
-            while True:
-                data = await websocket.recv()
-                if isinstance(data, str):
-                    json_data = json.loads(data)
-                    if json_data.get("end_of_file"):
-                        break
-                    if "code" in json_data:
-                        raise Exception(json.dumps(json_data))
-                else:
-                    file_data.extend(data)
+        file_data = await read_task_file(task_data)
         if not file_data:
             raise ValueError("Empty file data")
 
@@ -265,10 +310,10 @@ async def parse_task(task_data: Dict[str, Any], backend_client: HttpClient, clic
         await update_status(backend_client, task_data["FileHash"], -2)  # ZIP文件错误
     except Exception as e:
         print("Error:", e)
-        # 处理文件不存在等错误
+        # 处理文件不存在等错误; NDS熔断(502)或网关重试后仍繁忙(429/503)时任务退回待处理, 由其他节点或稍后重新分发
         try:
             error_data = json.loads(str(e)) if isinstance(str(e), str) else e
-            status = -1 if error_data.get("code") == 404 else -2
+            status = {404: -1, 429: 0, 502: 0, 503: 0}.get(error_data.get("code"), -2)
         except Exception:
             status = -2
         await update_status(backend_client, task_data["FileHash"], status)